@@ -0,0 +1,216 @@
+"""Benchmarks for the patterns.py pattern engine.
+
+Times pattern compilation and matching separately for each operator family, against word lists
+from the bundled corpora, and records NFA sizes and peak memory usage, as well as the startup time of the
+command line tool (which matters for scripts that call it repeatedly). Results are output as JSON
+so that runs from different commits can be compared (using --compare).
+
+Usage: python benchmarks/bench_patterns.py [-o results.json] [--compare baseline.json]
+"""
+
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import pudzu.sandbox.patterns as patterns  # noqa: E402 pylint: disable=wrong-import-position
+
+DEFAULT_CORPUS = REPO_ROOT / "corpora" / "RankedWiktionary.txt"
+
+# benchmark patterns, grouped by operator family (\w refers to the benchmark dictionary)
+MATCH_FAMILIES: Dict[str, List[str]] = {
+    "concatenation": ["th.*ing", "(?&v=[aeiou])(?&v).*(?&v)", r"\w\w"],
+    "both": [".*e.*&.*s&.{5,8}", r"\w&.*q.*"],
+    "contains": [r"\w<(ing|ed)", r"\w<<.*"],
+    "interleaved": ["the^.*", r"\w^(ab)", r"\w^^s"],
+    "alternating": ["(me)+#..", r"\w#."],
+    "subtraction": [r"\w-s", r"\w_-.", r"\w->.", r"\w-<.", r"\w-#.", r"\w-^."],
+    "rotation": [r"(?R1:\w)", "(?R<=2:hello)"],
+    "slice": [r"(?S:\w)[1:-1]", r"(?S:\w)[::2]"],
+    "dfa": [r"(?D:\w)", r"(?M:\w)", "(?M:.*a.{3})", "¬(.*e.*)"],
+}
+REGEX_PATTERNS: List[str] = ["(a|b)*c", "(?M:.*a.{3})", "(the|a)+", "o+<l+", "¬(.*no.*)"]
+# command lines whose total running time (mostly interpreter and module startup) is measured
+STARTUP_COMMANDS: Dict[str, List[str]] = {
+    "import": ["-c", "import pudzu.sandbox.patterns"],
+    "help": ["-m", "pudzu.sandbox.patterns", "--help"],
+    "query": ["-m", "pudzu.sandbox.patterns", "--no-cache", "-E", "1", "th.*ing"],
+}
+
+
+def load_words(path: Path, limit: Optional[int]) -> List[str]:
+    """Load a word list, ignoring any @rank suffixes (as used by RankedWiktionary.txt)."""
+    words = []
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            word = line.rstrip("\n").split("@")[0]
+            if word:
+                words.append(word)
+    if limit is not None and len(words) > limit:
+        # take an evenly spaced sample, so that the benchmark words are spread across the alphabet
+        words = [words[i * len(words) // limit] for i in range(limit)]
+    return words
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> Tuple[Any, float]:
+    """Call a function repeatedly, returning its last result and the fastest time."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def peak_memory(fn: Callable[[], Any]) -> int:
+    """The peak memory allocated (in KiB) while calling a function."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def compile_pattern(pattern: str) -> patterns.Pattern:
+    patterns.SUBPATTERNS.clear()
+    return patterns.Pattern(pattern)
+
+
+def match_words(pattern: str, nfa: patterns.NFA, words: List[str]) -> int:
+    # use a fresh Pattern so that the lazy DFA and prefilters are generated within the timing
+    compiled = patterns.Pattern(pattern, patterns.NFA(nfa.start, nfa.end, nfa.transitions, nfa.captures))
+    return sum(compiled.match(word) is not None for word in words)
+
+
+def benchmark_match(family: str, pattern: str, words: List[str], repeat: int, memory: bool) -> Dict[str, Any]:
+    compiled, compile_time = timed(lambda: compile_pattern(pattern), repeat)
+    matches, match_time = timed(lambda: match_words(pattern, compiled.nfa, words), repeat)
+    result = {
+        "family": family,
+        "pattern": pattern,
+        "states": len(compiled.nfa.states),
+        "transitions": len(compiled.nfa.transitions),
+        "compile_seconds": round(compile_time, 4),
+        "match_seconds": round(match_time, 4),
+        "matches": matches,
+    }
+    if memory:
+        result["compile_peak_kib"] = peak_memory(lambda: compile_pattern(pattern))
+        result["match_peak_kib"] = peak_memory(lambda: match_words(pattern, compiled.nfa, words))
+    return result
+
+
+def benchmark_regex(pattern: str, repeat: int, memory: bool) -> Dict[str, Any]:
+    compiled, compile_time = timed(lambda: compile_pattern(pattern), repeat)
+    regex, regex_time = timed(lambda: compiled.nfa.regex(), repeat)
+    result = {
+        "family": "regex",
+        "pattern": pattern,
+        "states": len(compiled.nfa.states),
+        "transitions": len(compiled.nfa.transitions),
+        "compile_seconds": round(compile_time, 4),
+        "regex_seconds": round(regex_time, 4),
+        "regex_length": len(str(regex)),
+    }
+    if memory:
+        result["compile_peak_kib"] = peak_memory(lambda: compile_pattern(pattern))
+        result["regex_peak_kib"] = peak_memory(lambda: compiled.nfa.regex())
+    return result
+
+
+def benchmark_startup(name: str, args: List[str], repeat: int) -> Dict[str, Any]:
+    def run() -> None:
+        subprocess.run([sys.executable, *args], cwd=REPO_ROOT, capture_output=True, check=True)
+
+    _, startup_time = timed(run, repeat)
+    return {"family": "startup", "pattern": name, "startup_seconds": round(startup_time, 4)}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> None:
+    """Print the timing ratios between two benchmark runs, flagging any regressions."""
+    old_results = {(r["family"], r["pattern"]): r for r in old["results"]}
+    for r in new["results"]:
+        o = old_results.get((r["family"], r["pattern"]))
+        if o is None:
+            continue
+        for key in ("compile_seconds", "match_seconds", "regex_seconds", "startup_seconds", "states"):
+            if key in r and key in o and o[key]:
+                ratio = r[key] / o[key]
+                flag = "  REGRESSION" if ratio > threshold and r[key] - o[key] > 0.01 else ""
+                print(f"{r['family']:14} {r['pattern']:28} {key:16} {o[key]:>10} -> {r[key]:>10} ({ratio:.2f}x){flag}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the patterns.py pattern engine.")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS, help="word list to match against")
+    parser.add_argument("--words", type=int, default=20000, help="number of corpus words to match against")
+    parser.add_argument("--dict-size", type=int, default=1000, help="number of corpus words to use for \\w")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timing repeats (the fastest is reported)")
+    parser.add_argument("--family", action="append", help="only run the given operator families")
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slower) peak memory measurements")
+    parser.add_argument("-o", "--output", type=Path, help="output JSON file (defaults to stdout)")
+    parser.add_argument("--compare", type=Path, help="previous JSON output to compare results against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="timing ratio to flag as a regression")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    logging.getLogger("patterns").setLevel(logging.ERROR)
+    words = load_words(args.corpus, args.words)
+    patterns.DICTIONARY_FSM = patterns.MatchWords(load_words(args.corpus, args.dict_size))
+
+    results = []
+    for family, family_patterns in MATCH_FAMILIES.items():
+        if args.family and family not in args.family:
+            continue
+        for pattern in family_patterns:
+            print(f"Benchmarking {family}: {pattern}", file=sys.stderr)
+            results.append(benchmark_match(family, pattern, words, args.repeat, not args.no_memory))
+    if not args.family or "regex" in args.family:
+        for pattern in REGEX_PATTERNS:
+            print(f"Benchmarking regex: {pattern}", file=sys.stderr)
+            results.append(benchmark_regex(pattern, args.repeat, not args.no_memory))
+    if not args.family or "startup" in args.family:
+        for name, command in STARTUP_COMMANDS.items():
+            print(f"Benchmarking startup: {name}", file=sys.stderr)
+            results.append(benchmark_startup(name, command, args.repeat))
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": str(args.corpus),
+            "words": len(words),
+            "dict_size": args.dict_size,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(output, indent=2), encoding="utf-8")
+    else:
+        print(json.dumps(output, indent=2))
+    if args.compare:
+        compare(json.loads(args.compare.read_text(encoding="utf-8")), output, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
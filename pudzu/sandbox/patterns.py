@@ -1,23 +1,54 @@
 import argparse
+import gc
+import hashlib
+import importlib
+import inspect
+import io
 import logging
 import math
+import mmap
+import multiprocessing
+import operator
+import os
 import random
 import re
 import string
+import sys
+import time
 import warnings
+import weakref
 from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
 from enum import Enum
-from functools import lru_cache, reduce
-from itertools import groupby, product
+from functools import lru_cache, partial, reduce, wraps
+from heapq import heapify, heappop, heappush
+from itertools import count, groupby, islice, product
 from pathlib import Path
-from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple, Union, cast
+from typing import TYPE_CHECKING, Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union, cast
 
-import graphviz
-from pudzu.utils import first, merge, merge_with
-from pyparsing import ParseException
-from pyparsing import printables as ascii_printables
-from pyparsing import pyparsing_unicode as ppu
-from pyparsing import srange
+if TYPE_CHECKING:
+    from pyparsing import ParserElement
+
+
+class LazyModule:
+    """Module proxy that only imports the module when it's first used. This keeps startup fast for the command line,
+    as most runs don't need rendering or vectorised matching."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[Any] = None
+
+    def __getattr__(self, attr: str) -> Any:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+graphviz = LazyModule("graphviz")
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
 
 State = Any  # really it's Union[str, Tuple['State']]
 Move = Enum("Move", "EMPTY ALL")
@@ -33,8 +64,24 @@ DEBUG = False
 DICTIONARY_FSM = None
 EXPLICIT_FSM = None
 SUBPATTERNS = {}
+PROFILER: Optional["Profiler"] = None
 EXTRA_PRINTABLES = ""
 SLOW_SIMPLIFICATION = True
+LAZY_DFA_CACHE_SIZE = 10000
+BIT_PARALLEL_MAX_STATES = 128
+BIT_PARALLEL_DFA_RATIO = 16
+BATCH_SIZE = 1 << 16
+REGEX_IMPLIES_CACHE_SIZE = 1 << 16
+REGEX_NFA_CACHE_SIZE = 1 << 10
+ASCII_PRINTABLES = "".join(c for c in string.printable if c not in string.whitespace)
+EXAMPLE_ALPHABET = string.ascii_letters + string.digits + " '"
+EXAMPLE_LENGTH_RANGE = 10
+NFA_MAGIC = b"PNFA"
+NFA_FORMAT_VERSION = 1
+PARALLEL_CHUNK_SIZE = 1 << 20
+DICTIONARY_CACHE_KEY = r"\w"
+MAX_FOLDED_WORDS = 1000
+DEFAULT_CACHE_DIR = str(Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")) / "patterns")
 
 
 class NFA:
@@ -50,27 +97,94 @@ class NFA:
         self.transitions = transitions
         self.captures = captures or {}
         self.states = {self.start, self.end} | {s for s, _ in self.transitions.keys()} | {t for ts in self.transitions.values() for t in ts}
+        self._outgoing: Optional[Dict[State, Dict[Input, Set[State]]]] = None
+        self._incoming: Optional[Dict[State, List[Tuple[State, Input]]]] = None
+        self._compiled: Optional["CompiledNFA"] = None
+        self._lazy_dfa: Optional["LazyDFA"] = None
+        self._bit_parallel: Optional["BitParallelNFA"] = None
 
     def __repr__(self) -> str:
         return f"NFA(start={self.start}, end={self.end}, transitions={self.transitions})"
 
+    @property
+    def outgoing(self) -> Dict[State, Dict[Input, Set[State]]]:
+        """Transitions indexed by source state."""
+        if self._outgoing is None:
+            self._outgoing = {}
+            for (s, i), ts in self.transitions.items():
+                self._outgoing.setdefault(s, {})[i] = ts
+        return self._outgoing
+
+    @property
+    def incoming(self) -> Dict[State, List[Tuple[State, Input]]]:
+        """Transitions indexed by target state."""
+        if self._incoming is None:
+            self._incoming = {}
+            for k, ts in self.transitions.items():
+                for t in ts:
+                    self._incoming.setdefault(t, []).append(k)
+        return self._incoming
+
+    def compiled(self) -> "CompiledNFA":
+        """A compact integer-indexed version of the NFA, used for matching and analysis."""
+        if self._compiled is None:
+            self._compiled = CompiledNFA(self)
+        return self._compiled
+
+    def lazy_dfa(self) -> "LazyDFA":
+        """A lazily constructed DFA for the NFA, shared between calls to match."""
+        if self._lazy_dfa is None:
+            self._lazy_dfa = LazyDFA(self.compiled())
+        return self._lazy_dfa
+
+    def matcher(self) -> Union["LazyDFA", "BitParallelNFA"]:
+        """The matcher used for capture-free matches. This is normally a lazy DFA, but small NFAs switch to bit-parallel
+        simulation if their lazy DFA grows much larger than the NFA (in which case most steps are cache misses)."""
+        if self._bit_parallel is not None:
+            return self._bit_parallel
+        dfa = self.lazy_dfa()
+        compiled = self.compiled()
+        if len(compiled) <= BIT_PARALLEL_MAX_STATES and dfa.created > BIT_PARALLEL_DFA_RATIO * len(compiled):
+            logger.debug("Switching to bit-parallel matching after generating %d DFA states", dfa.created)
+            self._bit_parallel = BitParallelNFA(compiled)
+            return self._bit_parallel
+        return dfa
+
     def match(self, string: str) -> Optional[CaptureOutput]:
         """Match the NFA against a string input. Returns a CaptureOutput if found, or None otherwise."""
-        old_states: Dict[State, CaptureOutput] = {self.start: {}}
+        if not self.matcher().match(string):
+            return None
+        return self.match_captures(string) if self.captures else {}
+
+    def match_captures(self, string: str) -> Optional[CaptureOutput]:
+        """Match the NFA against a string input, tracking submatch captures along the way. Rather than carrying the
+        captures for every live state, this records how each state was reached, and then walks back along the match."""
+        steps: List[Dict[State, Tuple[State, Set[CaptureGroup]]]] = []
+        closures: Dict[State, Set[State]] = {}
+        states: Iterable[State] = [self.start]
         for c in string:
-            new_states: Dict[State, CaptureOutput] = {}
-            for s, co in old_states.items():
-                for se in self.expand_epsilons({s}):
+            new_states: Dict[State, Tuple[State, Set[CaptureGroup]]] = {}
+            for s in states:
+                if s not in closures:
+                    closures[s] = self.expand_epsilons({s})
+                for se in closures[s]:
                     for t in self.transitions.get((se, c), self.transitions.get((se, Move.ALL), set())):
                         if t not in new_states:
                             cgs = self.captures.get((se, c), set()) if (se, c) in self.transitions else self.captures.get((se, Move.ALL), set())
-                            tco = merge(co, {cg: co.get(cg, "") + c for cg in cgs})
-                            new_states[t] = tco
-            old_states = new_states
-        for s, co in old_states.items():
-            if self.end in self.expand_epsilons({s}):
-                return co
-        return None
+                            new_states[t] = (s, cgs)
+            if not new_states:
+                return None
+            steps.append(new_states)
+            states = new_states
+        state = next((s for s in states if self.end in self.expand_epsilons({s})), None)
+        if state is None:
+            return None
+        captured: Dict[CaptureGroup, List[str]] = {}
+        for c, step in zip(reversed(string), reversed(steps)):
+            state, cgs = step[state]
+            for cg in cgs:
+                captured.setdefault(cg, []).append(c)
+        return {cg: "".join(reversed(cs)) for cg, cs in captured.items()}
 
     def expand_epsilons(self, states: Iterable[State]) -> Set[State]:
         """Expand a collection of states along all ε-moves"""
@@ -81,20 +195,43 @@ class NFA:
             new = {t for s in new for t in self.transitions.get((s, Move.EMPTY), set()) if t not in old}
         return old
 
+    def sources(self, state: State, input: Optional[Input] = None) -> Set[State]:
+        """States with a transition to the given state (optionally restricted to a given input)."""
+        return {s for s, i in self.incoming.get(state, ()) if input is None or i == input}
+
+    def trimmed(self, start: Optional[State] = None, end: Optional[State] = None) -> "NFA":
+        """A copy of the NFA with either a new start (keeping only the states reachable from it) or a new end (keeping only
+        the states that can reach it). Unlike remove_redundant_states, this only explores the part of the NFA that is kept."""
+        if (start is None) == (end is None):
+            raise ValueError("Expected exactly one of start and end")
+        keep: Set[State] = set()
+        new = {start} if end is None else {end}
+        while new:
+            keep.update(new)
+            if end is None:
+                new = {t for s in new for ts in self.outgoing.get(s, {}).values() for t in ts if t not in keep}
+            else:
+                new = {s for t in new for s, _ in self.incoming.get(t, ()) if s not in keep}
+        transitions = {(s, i): ts & keep for s in keep for i, ts in self.outgoing.get(s, {}).items()}
+        captures = {k: cs for k, cs in self.captures.items() if k in transitions}
+        return NFA(self.start if start is None else start, self.end if end is None else end, transitions, captures)
+
     def remove_redundant_states(self, aggressive: bool = False) -> None:
         """Trim the NFA, removing unnecessary states and transitions."""
+        before = (len(self.states), len(self.transitions))
+        self._compiled = None
+        self._lazy_dfa = None
+        self._bit_parallel = None
         # remove states not reachable from the start
         reachable, new = set(), {self.start}
         while new:
             reachable.update(new)
-            new = {t for (s, i), ts in self.transitions.items() if s in new for t in ts if t not in reachable}
-        self.states = reachable | {self.start, self.end}
-        self.transitions = {(s, i): ts for (s, i), ts in self.transitions.items() if s in reachable}
+            new = {t for s in new for ts in self.outgoing.get(s, {}).values() for t in ts if t not in reachable}
         # remove states that can't reach the end (and any transitions to those states)
         acceptable, new = set(), {self.end}
         while new:
             acceptable.update(new)
-            new = {s for (s, i), ts in self.transitions.items() if any(t in new for t in ts) and s not in acceptable}
+            new = {s for t in new for s, _ in self.incoming.get(t, ()) if s in reachable and s not in acceptable}
         self.states = acceptable | {self.start, self.end}
         self.transitions = {
             (s, i): {t for t in ts if t in acceptable}
@@ -134,6 +271,11 @@ class NFA:
                     del self.transitions[k]
                 self.states -= removable
 
+        self._outgoing = None
+        self._incoming = None
+        if PROFILER is not None:
+            PROFILER.trimmed(before[0] - len(self.states), before[1] - len(self.transitions))
+
     def render(self, name: str, console: bool = False, compact: bool = False) -> None:
         """Render the NFA as a dot.svg file."""
         bg = "transparent" if console else "white"
@@ -146,12 +288,12 @@ class NFA:
         ends = {self.end}
 
         if compact:
-            if {i for (s, i) in self.transitions if s == self.start} == {Move.EMPTY} and len(self.transitions.get((self.start, Move.EMPTY), set())) == 1:
+            if set(self.outgoing.get(self.start, {})) == {Move.EMPTY} and len(self.transitions[(self.start, Move.EMPTY)]) == 1:
                 states.remove(self.start)
                 start = first(self.transitions[(self.start, Move.EMPTY)])
-            if {i for (s, i), ts in self.transitions.items() if self.end in ts} == {Move.EMPTY}:
+            if {i for _, i in self.incoming.get(self.end, ())} == {Move.EMPTY}:
                 states.remove(self.end)
-                ends = {s for (s, i), ts in self.transitions.items() if self.end in ts}
+                ends = {s for s, _ in self.incoming[self.end]}
 
         # states
         for s in states:
@@ -179,7 +321,7 @@ class NFA:
                     if move == Move.EMPTY:
                         label = "ε"
                     else:
-                        label = char_class("".join(j for u, j in self.transitions if u == s and isinstance(j, str)), negated=True)
+                        label = char_class("".join(j for j in self.outgoing[s] if isinstance(j, str)), negated=True)
                     if c:
                         label += f" {{{','.join(c)}}}"
                     g.edge(str(s), str(t), label=label, color=fg, fontcolor=fg)
@@ -193,14 +335,14 @@ class NFA:
         g.render(filename=name + ".dot")
 
     def save(self, name: str, renumber_states: bool = True) -> None:
-        """Save FSM as a .fsm file."""
-        # TODO: save and load capture groups
+        """Save FSM as a .fsm text description (including capture groups), along with a binary .fsmb companion."""
 
         def sort_key(s):
             # Q: is there a better state ordering?
             return "" if s == self.start else ")" if s == self.end else str(s)
 
-        sorted_states = sorted(self.states, key=sort_key)
+        numbering = {s: n for n, s in enumerate(sorted(self.states, key=sort_key))}
+        sorted_states = list(numbering)
 
         def label(s):
             return (
@@ -208,43 +350,311 @@ class NFA:
                 if s == self.start
                 else "END"
                 if s == self.end
-                else str(sorted_states.index(s))
+                else str(numbering[s])
                 if renumber_states
                 else str(s).replace("'", "").replace(" ", "")
             )
 
         with open(name + ".fsm", "w", encoding="utf-8") as f:
-            reverse_dict: Dict[State, Dict[FrozenSet[State], Set[Input]]] = {}
+            reverse_dict: Dict[State, Dict[Tuple[FrozenSet[State], FrozenSet[CaptureGroup]], Set[Input]]] = {}
             for (s, i), ts in self.transitions.items():
-                reverse_dict.setdefault(s, {}).setdefault(frozenset(ts), set()).add(i)
+                reverse_dict.setdefault(s, {}).setdefault((frozenset(ts), frozenset(self.captures.get((s, i), ()))), set()).add(i)
             for state in sorted_states:
                 from_label = label(state)
-                for fts, ii in reverse_dict.get(state, {}).items():
-                    to_labels = " ".join(label(t) for t in fts)
+                for (fts, fcs), ii in reverse_dict.get(state, {}).items():
+                    to_labels = " ".join([*(label(t) for t in fts), *([f"{{{','.join(sorted(fcs))}}}"] if fcs else [])])
                     for move in (i for i in ii if isinstance(i, Move)):
                         print(f"{from_label} {str(move).replace('Move.','')} {to_labels}", file=f)
                     input = "".join(sorted(i for i in ii if isinstance(i, str)))
+                    if " " in input:
+                        # (spaces are written separately, as the file is whitespace-delimited)
+                        print(f"{from_label} SPACE {to_labels}", file=f)
+                        input = input.replace(" ", "")
                     if len(input) >= 1:
-                        input_label = "SPACE" if input == " " else char_class(input)
-                        print(f"{from_label} {input_label} {to_labels}", file=f)
+                        print(f"{from_label} {char_class(input)} {to_labels}", file=f)
+        with open(name + ".fsmb", "wb") as f:
+            f.write(self.to_bytes())
+
+    def to_bytes(self) -> bytes:
+        """Serialise FSM (including capture groups) into a compact binary format. States are renumbered."""
+        numbering = {self.start: 0, self.end: 1}
+        for s in self.states:
+            numbering.setdefault(s, len(numbering))
+        groups = sorted({c for cs in self.captures.values() for c in cs})
+        group_ids = {c: n for n, c in enumerate(groups)}
+        body = array("i", [len(numbering), len(self.transitions)])
+        for (s, i), ts in self.transitions.items():
+            body.extend((numbering[s], input_code(i), len(ts)))
+            body.extend(numbering[t] for t in ts)
+        body.extend((len(groups), len(self.captures)))
+        for (s, i), cs in self.captures.items():
+            body.extend((numbering[s], input_code(i), len(cs)))
+            body.extend(group_ids[c] for c in cs)
+        names = "\0".join(groups).encode("utf-8")
+        header = NFA_MAGIC + bytes([NFA_FORMAT_VERSION, sys.byteorder == "big"])
+        return header + array("i", [len(body), len(names)]).tobytes() + body.tobytes() + names
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "NFA":
+        """Load FSM from the binary format generated by to_bytes."""
+        with memoryview(data) as view:
+            offset = len(NFA_MAGIC) + 2
+            if view[: len(NFA_MAGIC)] != NFA_MAGIC or len(view) < offset + 2 * array("i").itemsize:
+                raise ValueError("Not a binary FSM description")
+            version, big_endian = view[len(NFA_MAGIC) : offset]
+            if version != NFA_FORMAT_VERSION:
+                raise ValueError(f"Unsupported binary FSM version {version}")
+            swap = bool(big_endian) != (sys.byteorder == "big")
+            sizes, body = array("i"), array("i")
+            sizes.frombytes(view[offset : offset + 2 * sizes.itemsize])
+            if swap:
+                sizes.byteswap()
+            offset += 2 * sizes.itemsize
+            body.frombytes(view[offset : offset + sizes[0] * body.itemsize])
+            if swap:
+                body.byteswap()
+            names = str(view[offset + sizes[0] * body.itemsize :], "utf-8")
+        if len(body) != sizes[0] or len(names.encode("utf-8")) != sizes[1]:
+            raise ValueError("Truncated binary FSM description")
+        # (indexing a list is much faster than indexing the array, and most input codes are repeated many times;
+        # we also pause garbage collection, which would otherwise repeatedly rescan the newly allocated transitions)
+        values = body.tolist()
+        inputs: Dict[int, Input] = {}
+        transitions: Transitions = {}
+        pos = 2
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for _ in range(values[1]):
+                s, i, n = values[pos], values[pos + 1], values[pos + 2]
+                input = inputs.get(i) or inputs.setdefault(i, input_from_code(i))
+                transitions[(s, input)] = {values[pos + 3]} if n == 1 else set(values[pos + 3 : pos + 3 + n])
+                pos += 3 + n
+        finally:
+            if gc_enabled:
+                gc.enable()
+        groups = names.split("\0") if values[pos] else []
+        captures: Captures = {}
+        for _ in range(values[pos + 1]):
+            s, i, n = values[pos + 2 : pos + 5]
+            captures[(s, input_from_code(i))] = {groups[c] for c in values[pos + 5 : pos + 5 + n]}
+            pos += 3 + n
+        return cls(0, 1, transitions, captures)
 
     def example(self, min_length: int = 0, max_length: Optional[int] = None) -> Optional[str]:
         """Generate a random matching string. Assumes NFA has been trimmed of states that can't reach the end."""
         nfa = MatchBoth(self, MatchLength(min_length, max_length)) if min_length or max_length is not None else self
+        return nfa.compiled().example()
+
+    def bound(self, lower_bound: bool, max_length: int) -> Optional[str]:
+        """Generate a lower/upper lexicographic bound for the FSM."""
+        return self.compiled().bound(lower_bound, max_length)
+
+    def regex(self) -> "Regex":
+        """Generate a regex corresponding to the NFA, via state elimination. Only non-empty edges are stored, and states
+        are eliminated in order of how much they would grow the total regex size, which keeps intermediate regexes small.
+        Fresh start and end states are linked to the NFA's own by ε-moves, so that these get eliminated like any other."""
+        index = {s: n for n, s in enumerate(sorted(self.states, key=str))}
+        start, end = len(index), len(index) + 1
+        edges: Dict[int, Dict[int, Regex]] = {n: {} for n in range(len(index) + 2)}
+        sources: Dict[int, Set[int]] = {n: set() for n in range(len(index) + 2)}
+        edges[start][index[self.start]] = edges[index[self.end]][end] = RegexConcat()
+        sources[index[self.start]].add(start)
+        sources[end].add(index[self.end])
+        for (i, a), js in self.transitions.items():
+            for j in js:
+                if a == Move.ALL:
+                    r: Regex = RegexNegatedChars("".join(b for b in self.outgoing[i] if isinstance(b, str)))
+                elif a == Move.EMPTY:
+                    r = RegexConcat()
+                else:
+                    r = RegexChars(a)
+                edge = edges[index[i]].get(index[j])
+                edges[index[i]][index[j]] = r if edge is None else edge | r
+                sources[index[j]].add(index[i])
+
+        def cost(k: int) -> int:
+            # Delgado & Morais's state weight: the increase in total regex length caused by eliminating k
+            ins, outs = sources[k] - {k}, edges[k].keys() - {k}
+            loop = len(str(edges[k][k])) if k in edges[k] else 0
+            return (
+                sum(len(str(edges[i][k])) for i in ins) * (len(outs) - 1)
+                + sum(len(str(edges[k][j])) for j in outs) * (len(ins) - 1)
+                + loop * (len(ins) * len(outs) - 1)
+            )
+
+        queue = [(cost(k), k) for k in index.values()]
+        heapify(queue)
+        eliminated: Set[int] = set()
+        while queue:
+            c, k = heappop(queue)
+            if k in eliminated or c != cost(k):
+                continue
+            eliminated.add(k)
+            loop = edges[k].pop(k, None)
+            sources[k].discard(k)
+            star = RegexStar(loop) if loop is not None else RegexConcat()
+            for i in sources[k]:
+                into = edges[i].pop(k)
+                for j, out in edges[k].items():
+                    path = RegexConcat((into, star, out))
+                    edge = edges[i].get(j)
+                    edges[i][j] = path if edge is None else edge | path
+                    sources[j].add(i)
+            for j in edges[k]:
+                sources[j].discard(k)
+            for n in sources[k] | edges[k].keys():
+                if n not in eliminated and n not in (start, end):
+                    heappush(queue, (cost(n), n))
+        return edges[start].get(end, RegexUnion())
+
+    def min_length(self) -> Optional[int]:
+        """ The minimum possible length match. """
+        return self.compiled().min_length()
+
+    def max_length(self) -> Optional[int]:
+        """ The maximum possible length match. """
+        return self.compiled().max_length()
+
+    def length_spectrum(self) -> "LengthSpectrum":
+        """ The exact set of possible match lengths. """
+        return self.compiled().length_spectrum()
+
+
+class CompiledNFA:
+    """Compact representation of an NFA, used for matching and analysis:
+    - states are renumbered to dense ints (with the original labels kept in self.labels)
+    - each state's character transitions are held in flat arrays, sorted by character
+    - ε-closures are precomputed and held in flat arrays too
+    Submatch captures are ignored."""
+
+    def __init__(self, nfa: NFA):
+        self.labels: List[State] = list(dict.fromkeys([nfa.start, *(nfa.states - {nfa.start, nfa.end}), nfa.end]))
+        index = {s: n for n, s in enumerate(self.labels)}
+        self.start, self.end = index[nfa.start], index[nfa.end]
+        chars: List[List[Tuple[int, int]]] = [[] for _ in self.labels]
+        alls: List[List[int]] = [[] for _ in self.labels]
+        empties: List[List[int]] = [[] for _ in self.labels]
+        for (s, i), ts in nfa.transitions.items():
+            n = index[s]
+            if i == Move.EMPTY:
+                empties[n].extend(index[t] for t in ts)
+            elif i == Move.ALL:
+                alls[n].extend(index[t] for t in ts)
+            elif ts:
+                chars[n].extend((ord(i), index[t]) for t in ts)
+            else:
+                # explicit transitions with no targets are kept (as -1) since they block *-moves
+                chars[n].append((ord(i), -1))
+        self.offsets, self.chars, self.targets = array("l", [0]), array("l"), array("l")
+        for edges in chars:
+            edges.sort()
+            self.chars.extend(c for c, _ in edges)
+            self.targets.extend(t for _, t in edges)
+            self.offsets.append(len(self.chars))
+        self.all_offsets, self.all_targets = self._flatten(alls)
+        self.empty_offsets, self.empty_targets = self._flatten(empties)
+        self.closure_offsets, self.closure_states = self._flatten(self._closures(empties))
+        self._sources: Optional[List[List[Tuple[int, int]]]] = None
+        self._live: Optional[Set[int]] = None
+        self._alphabet: Optional["Alphabet"] = None
+
+    def __repr__(self) -> str:
+        return f"CompiledNFA(states={len(self.labels)}, transitions={len(self.chars) + len(self.all_targets) + len(self.empty_targets)})"
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @staticmethod
+    def _flatten(lists: List[List[int]]) -> Tuple[array, array]:
+        """Flatten a list of lists into offset and value arrays."""
+        offsets, values = array("l", [0]), array("l")
+        for l in lists:
+            values.extend(l)
+            offsets.append(len(values))
+        return offsets, values
+
+    @staticmethod
+    def _closures(empties: List[List[int]]) -> List[List[int]]:
+        """Calculate the ε-closures of all the states."""
+        closures = []
+        for n, ts in enumerate(empties):
+            closure = {n}
+            todo = list(ts)
+            while todo:
+                t = todo.pop()
+                if t not in closure:
+                    closure.add(t)
+                    todo.extend(empties[t])
+            closures.append(sorted(closure))
+        return closures
+
+    def closure(self, state: int) -> Sequence[int]:
+        """The ε-closure of a state."""
+        return self.closure_states[self.closure_offsets[state] : self.closure_offsets[state + 1]]
+
+    def expand_epsilons(self, states: Iterable[int]) -> FrozenSet[int]:
+        """Expand a collection of states along all ε-moves."""
+        return frozenset(t for s in states for t in self.closure(s))
+
+    def char_moves(self, state: int) -> Dict[str, List[int]]:
+        """The explicit character transitions from a state (including ones with no targets)."""
+        moves: Dict[str, List[int]] = {}
+        for n in range(self.offsets[state], self.offsets[state + 1]):
+            targets = moves.setdefault(chr(self.chars[n]), [])
+            if self.targets[n] >= 0:
+                targets.append(self.targets[n])
+        return moves
+
+    def all_moves(self, state: int) -> Sequence[int]:
+        """The targets of a state's *-transition."""
+        return self.all_targets[self.all_offsets[state] : self.all_offsets[state + 1]]
+
+    def empty_moves(self, state: int) -> Sequence[int]:
+        """The targets of a state's ε-transition."""
+        return self.empty_targets[self.empty_offsets[state] : self.empty_offsets[state + 1]]
+
+    def moves(self, state: int, char: str) -> Sequence[int]:
+        """The targets reached from a state by consuming a character."""
+        lo, hi = self.offsets[state], self.offsets[state + 1]
+        c = ord(char)
+        i = bisect_left(self.chars, c, lo, hi)
+        if i < hi and self.chars[i] == c:
+            return [t for t in self.targets[i : bisect_right(self.chars, c, i, hi)] if t >= 0]
+        return self.all_moves(state)
+
+    def step(self, states: Iterable[int], char: str) -> FrozenSet[int]:
+        """The ε-expanded states reached from a collection of states by consuming a character."""
+        return self.expand_epsilons(t for s in states for t in self.moves(s, char))
+
+    def match(self, string: str) -> bool:
+        """Whether the NFA accepts a string input."""
+        states = self.expand_epsilons({self.start})
+        for c in string:
+            states = self.step(states, c)
+            if not states:
+                return False
+        return self.end in states
+
+    def example(self) -> Optional[str]:
+        """Generate a random matching string. Assumes NFA has been trimmed of states that can't reach the end."""
         output = ""
-        state = nfa.start
+        state = self.start
         try:
-            while state != nfa.end:
-                choices = [i for (s, i) in nfa.transitions if s == state]
-                non_empty = [i for i in choices if nfa.transitions[(state, i)]]
-                i = random.choice(non_empty)
+            while state != self.end:
+                choices: Dict[Input, Sequence[int]] = dict(self.char_moves(state))
+                if self.all_offsets[state] != self.all_offsets[state + 1]:
+                    choices[Move.ALL] = self.all_moves(state)
+                if self.empty_offsets[state] != self.empty_offsets[state + 1]:
+                    choices[Move.EMPTY] = self.empty_moves(state)
+                i = random.choice([i for i, ts in choices.items() if ts])
                 if i == Move.ALL:
                     # TODO: match with supported scripts?
-                    options = list(set(string.ascii_letters + string.digits + " '") - set(i for i in choices if isinstance(i, str)))
+                    options = list(set(EXAMPLE_ALPHABET) - set(i for i in choices if isinstance(i, str)))
                     output += random.choice(options)
                 elif isinstance(i, str):
                     output += i
-                state = random.choice(list(nfa.transitions[(state, i)]))
+                state = random.choice(choices[i])
         except IndexError:
             return None
         return output
@@ -258,14 +668,15 @@ class NFA:
             least_char = None
             next_state = None
             for state in states:
-                least_trans = minmax([i for (s, i), ts in self.transitions.items() if s == state and ts and isinstance(i, str)], default=None)
+                moves = self.char_moves(state)
+                least_trans = minmax([i for i, ts in moves.items() if ts], default=None)
                 if least_trans and (not least_char or least_trans == minmax((least_trans, least_char))):
-                    least_char, next_state = least_trans, first(self.transitions[(state, least_trans)])
-                if self.transitions.get((state, Move.ALL)):
+                    least_char, next_state = least_trans, moves[least_trans][0]
+                if self.all_moves(state):
                     # TODO: match with supported scripts?
-                    least_any = minmax(set(ascii_printables + " ") - {i for (s, i) in self.transitions if s == state})
+                    least_any = minmax(set(ASCII_PRINTABLES + " ") - set(moves))
                     if not least_char or least_any == minmax((least_any, least_char)):
-                        least_char, next_state = least_any, first(self.transitions[(state, Move.ALL)])
+                        least_char, next_state = least_any, self.all_moves(state)[0]
             if not least_char:
                 break
             bound += least_char
@@ -276,58 +687,935 @@ class NFA:
 
         return bound
 
-    def regex(self) -> "Regex":
-        """Generate a regex corresponding to the NFA."""
-        L = {(i, j): RegexConcat() if i == j else RegexUnion() for i in self.states for j in self.states}
-        for (i, a), js in self.transitions.items():
-            for j in js:
-                if a == Move.ALL:
-                    L[i, j] |= RegexNegatedChars("".join(b for k, b in self.transitions if i == k and isinstance(b, str)))
-                elif a == Move.EMPTY:
-                    L[i, j] |= RegexConcat()
-                else:
-                    L[i, j] |= RegexChars(a)
-        remaining = set(self.states)
-        for k in self.states:
-            if k == self.start or k == self.end:
-                continue
-            remaining.remove(k)
-            for i in remaining:
-                for j in remaining:
-                    L[i, i] |= RegexConcat((L[i, k], RegexStar(L[k, k]), L[k, i]))
-                    L[j, j] |= RegexConcat((L[j, k], RegexStar(L[k, k]), L[k, j]))
-                    L[i, j] |= RegexConcat((L[i, k], RegexStar(L[k, k]), L[k, j]))
-                    L[j, i] |= RegexConcat((L[j, k], RegexStar(L[k, k]), L[k, i]))
-
-        return L[self.start, self.end]
-
     def min_length(self) -> Optional[int]:
         """ The minimum possible length match. """
-        # use Dijkstra to find shortest path
-        unvisited = set(self.states)
-        distances = {s: 0 if s == self.start else math.inf for s in self.states}
-        current = self.start
-        while current in unvisited:
-            base = distances[current]
-            for (r, i), ss in self.transitions.items():
-                if r == current:
-                    weight = base + (i != Move.EMPTY)
-                    for s in ss:
-                        if s in unvisited:
-                            distances[s] = min(distances[s], weight)
-            unvisited.remove(current)
+        # edges consume either 0 or 1 characters, so a 0-1 BFS finds the shortest path
+        distances = {self.start: 0}
+        queue = deque([self.start])
+        while queue:
+            current = queue.popleft()
             if current == self.end:
-                return int(distances[self.end])
-            current, distance = min(distances.items(), key=lambda x: math.inf if x[0] not in unvisited else x[1])
-            if distance == math.inf:
-                return None
+                return distances[current]
+            for t, w in self.edges(current):
+                d = distances[current] + w
+                if d < distances.get(t, d + 1):
+                    distances[t] = d
+                    if w:
+                        queue.append(t)
+                    else:
+                        queue.appendleft(t)
         return None
 
+    def length_spectrum(self) -> "LengthSpectrum":
+        """The exact set of possible match lengths. Since the lengths of a regular language are ultimately periodic,
+        this is calculated by stepping through the live state sets reached by each length until one repeats."""
+        live = self.live_states()
+        if not live:
+            return LengthSpectrum(set(), 0, 0)
+        states = self.expand_epsilons({self.start}) & live
+        seen: Dict[FrozenSet[int], int] = {}
+        lengths = set()
+        while states and states not in seen:
+            seen[states] = len(seen)
+            if self.end in states:
+                lengths.add(len(seen) - 1)
+            targets: Set[int] = set()
+            for s in states:
+                targets.update(self.targets[self.offsets[s] : self.offsets[s + 1]])
+                targets.update(self.all_moves(s))
+            targets.discard(-1)
+            states = self.expand_epsilons(targets) & live
+        if not states:
+            return LengthSpectrum(lengths, len(seen), 0)
+        return LengthSpectrum(lengths, seen[states], len(seen) - seen[states])
+
+    def edges(self, state: int) -> List[Tuple[int, int]]:
+        """The targets reachable from a state by a single move, along with the number of characters consumed."""
+        edges = [(t, 0) for t in self.empty_targets[self.empty_offsets[state] : self.empty_offsets[state + 1]]]
+        edges.extend((t, 1) for t in self.targets[self.offsets[state] : self.offsets[state + 1]] if t >= 0)
+        edges.extend((t, 1) for t in self.all_targets[self.all_offsets[state] : self.all_offsets[state + 1]])
+        return edges
+
+    def sources(self) -> List[List[Tuple[int, int]]]:
+        """The moves leading into each state, as (source, input code) pairs. Generated on first use."""
+        if self._sources is None:
+            self._sources = [[] for _ in self.labels]
+            for offsets, chars, targets in (
+                (self.offsets, self.chars, self.targets),
+                (self.all_offsets, None, self.all_targets),
+                (self.empty_offsets, None, self.empty_targets),
+            ):
+                codes = chars or [input_code(Move.ALL if targets is self.all_targets else Move.EMPTY)] * len(targets)
+                states = [s for s in range(len(self.labels)) for _ in range(offsets[s + 1] - offsets[s])]
+                for s, i, t in zip(states, codes, targets):
+                    if t >= 0:
+                        self._sources[t].append((s, i))
+        return self._sources
+
+    def alphabet(self) -> "Alphabet":
+        """The partition of characters into classes with identical moves. Generated on first use."""
+        if self._alphabet is None:
+            self._alphabet = Alphabet(self)
+        return self._alphabet
+
+    def live_states(self) -> Set[int]:
+        """The states that are both reachable from the start and can reach the end. Generated on first use."""
+        if self._live is None:
+            sources = self.sources()
+            coreachable, todo = {self.end}, [self.end]
+            while todo:
+                for s, _ in sources[todo.pop()]:
+                    if s not in coreachable:
+                        coreachable.add(s)
+                        todo.append(s)
+            self._live, todo = set(), [self.start] if self.start in coreachable else []
+            self._live.update(todo)
+            while todo:
+                for t, _ in self.edges(todo.pop()):
+                    if t in coreachable and t not in self._live:
+                        self._live.add(t)
+                        todo.append(t)
+        return self._live
+
     def max_length(self) -> Optional[int]:
-        """ The maximum possible length match. """
-        # converts to a regex, though there's probably a more efficient way
-        max_length = self.regex().max_length()
-        return int(max_length) if math.isfinite(max_length) else None
+        """ The maximum possible length match (or None if it is unbounded). """
+        # find the strongly connected components of the live states using Tarjan's algorithm: these are generated in
+        # reverse topological order, so we can calculate the longest path to the end as we go
+        live = self.live_states()
+        if not live:
+            return None
+        index: Dict[int, int] = {}
+        lowlink: Dict[int, int] = {}
+        component: Dict[int, int] = {}
+        edges: Dict[int, List[Tuple[int, int]]] = {}
+        longest: List[int] = []
+        stack: List[int] = []
+
+        def visit(s: int) -> None:
+            index[s] = lowlink[s] = len(index)
+            edges[s] = [(t, w) for t, w in self.edges(s) if t in live]
+            stack.append(s)
+            work.append((s, 0))
+
+        for root in live:
+            if root in index:
+                continue
+            work: List[Tuple[int, int]] = []
+            visit(root)
+            while work:
+                s, n = work[-1]
+                while n < len(edges[s]):
+                    t = edges[s][n][0]
+                    n += 1
+                    if t not in index:
+                        work[-1] = (s, n)
+                        visit(t)
+                        break
+                    elif t not in component:
+                        lowlink[s] = min(lowlink[s], index[t])
+                else:
+                    work.pop()
+                    if work:
+                        lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[s])
+                    if lowlink[s] == index[s]:
+                        members = []
+                        while True:
+                            t = stack.pop()
+                            component[t] = len(longest)
+                            members.append(t)
+                            if t == s:
+                                break
+                        distance = 0 if self.end in members else -1
+                        for m in members:
+                            for t, w in edges.pop(m):
+                                if component[t] != component[s]:
+                                    distance = max(distance, w + longest[component[t]])
+                                elif w:
+                                    return None
+                        longest.append(distance)
+        return longest[component[self.start]]
+
+
+class LengthSpectrum:
+    """The set of possible match lengths, stored as the lengths below offset + period, which then repeat every period
+    (or, if period is 0, don't occur beyond the offset). The representation is normalised to the smallest offset and period."""
+
+    MAX_PARTS = 8
+
+    def __init__(self, lengths: Iterable[int], offset: int, period: int):
+        self.lengths = set(lengths)
+        self.offset, self.period = offset, period
+        if period:
+            self.period = min(p for p in range(1, period + 1) if period % p == 0 and self.is_periodic(offset, p))
+        for n in range(self.offset - 1, -1, -1):
+            if (n in self.lengths) != (self.period and n + self.period in self.lengths):
+                break
+            self.offset = n
+        self.lengths = {n for n in self.lengths if n < self.offset + self.period}
+
+    def is_periodic(self, offset: int, period: int) -> bool:
+        return all((n in self.lengths) == (n + period in self.lengths) for n in range(offset, offset + self.period - period))
+
+    def __repr__(self) -> str:
+        return f"LengthSpectrum({sorted(self.lengths)}, offset={self.offset}, period={self.period})"
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, LengthSpectrum) and (self.lengths, self.offset, self.period) == (other.lengths, other.offset, other.period)
+
+    def __contains__(self, length: int) -> bool:
+        if self.period and length >= self.offset:
+            length = self.offset + (length - self.offset) % self.period
+        return length in self.lengths
+
+    def __iter__(self) -> Iterator[int]:
+        """The possible lengths in increasing order (which may be unbounded)."""
+        yield from sorted(n for n in self.lengths if n < self.offset)
+        if self.period:
+            for n in count(self.offset):
+                if n in self:
+                    yield n
+
+    def __bool__(self) -> bool:
+        return bool(self.lengths)
+
+    @property
+    def min_length(self) -> Optional[int]:
+        return min(self.lengths, default=None)
+
+    @property
+    def max_length(self) -> Optional[int]:
+        return None if self.period else max(self.lengths, default=None)
+
+    def __str__(self) -> str:
+        ranges: List[Tuple[int, int]] = []
+        for n in sorted(n for n in self.lengths if n < self.offset):
+            if ranges and ranges[-1][1] == n - 1:
+                ranges[-1] = (ranges[-1][0], n)
+            else:
+                ranges.append((n, n))
+        parts = [str(a) if a == b else f"{a}-{b}" for a, b in ranges]
+        if self.period == 1 and self.offset in self.lengths:
+            parts.append(f"{self.offset}+")
+        elif self.period:
+            parts.extend(f"{self.period}n+{n}" if n else f"{self.period}n" for n in sorted(n for n in self.lengths if n >= self.offset))
+        return ", ".join(parts if len(parts) <= self.MAX_PARTS else parts[: self.MAX_PARTS] + ["..."])
+
+
+class Alphabet:
+    """Partition of characters into equivalence classes that have identical moves from every state of a compiled NFA
+    (class 0 being the characters with no explicit moves, which just use *-moves). This lets matchers and constructions
+    handle each class once, rather than each character. Classes are looked up in a table indexed by code point, with 256
+    entries if all the explicit characters are Latin-1 and 65536 otherwise (plus a dict for any astral characters)."""
+
+    def __init__(self, nfa: CompiledNFA):
+        signatures: Dict[int, List[Tuple[int, int]]] = {}
+        for s in range(len(nfa)):
+            for n in range(nfa.offsets[s], nfa.offsets[s + 1]):
+                signatures.setdefault(nfa.chars[n], []).append((s, nfa.targets[n]))
+        class_ids: Dict[Tuple[Tuple[int, int], ...], int] = {}
+        self.classes: List[List[str]] = [[]]
+        codes: Dict[int, int] = {}
+        for c, signature in signatures.items():
+            id = codes[c] = class_ids.setdefault(tuple(signature), len(self.classes))
+            if id == len(self.classes):
+                self.classes.append([])
+            self.classes[id].append(chr(c))
+        self.table = array("l", [0]) * (256 if max(codes, default=0) < 256 else 65536)
+        self.astral: Dict[str, int] = {}
+        for c, id in codes.items():
+            if c < len(self.table):
+                self.table[c] = id
+            else:
+                self.astral[chr(c)] = id
+        other = next(c for c in count() if c not in codes)
+        self.representatives = [chr(other), *(chars[0] for chars in self.classes[1:])]
+
+    def __repr__(self) -> str:
+        return f"Alphabet(classes={len(self.classes)}, table={len(self.table)})"
+
+    def __len__(self) -> int:
+        return len(self.classes)
+
+    def __getitem__(self, char: str) -> int:
+        """The class of a character."""
+        code = ord(char)
+        return self.table[code] if code < len(self.table) else self.astral.get(char, 0)
+
+
+class LazyDFA:
+    """DFA generated lazily from a compiled NFA via on-the-fly powerset construction.
+    Transitions are memoised the first time they are seen, so that later matches can reuse them. They are held in
+    a table with a row for each DFA state and a column for each character class of the NFA's alphabet (-1 if unseen).
+    The cache is bounded: once it exceeds max_states, it is flushed and rebuilt as needed."""
+
+    def __init__(self, nfa: CompiledNFA, max_states: int = LAZY_DFA_CACHE_SIZE):
+        self.nfa = nfa
+        self.alphabet = nfa.alphabet()
+        self.max_states = max_states
+        self.created = 0
+        self.flush()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(states={len(self.state_sets)}, transitions={sum(t >= 0 for row in self.transitions for t in row)})"
+
+    def flush(self) -> None:
+        """Empty the cache of DFA states and transitions."""
+        self.state_sets: List[FrozenSet[int]] = []
+        self.state_ids: Dict[FrozenSet[int], int] = {}
+        self.accepting: List[bool] = []
+        self.transitions: List[List[int]] = []
+        self.start = self.state_id(self.nfa.expand_epsilons({self.nfa.start}))
+        self.dead = self.state_id(frozenset())
+
+    def state_id(self, states: FrozenSet[int]) -> int:
+        """The DFA state corresponding to an (ε-expanded) set of NFA states."""
+        id = self.state_ids.get(states)
+        if id is None:
+            id = self.state_ids[states] = len(self.state_sets)
+            self.state_sets.append(states)
+            self.accepting.append(self.nfa.end in states)
+            self.transitions.append([-1] * len(self.alphabet))
+            self.created += 1
+        return id
+
+    def step(self, state: int, char: str) -> int:
+        """The DFA state reached from a given DFA state by consuming a character."""
+        return self.step_class(state, self.alphabet[char])
+
+    def step_class(self, state: int, id: int) -> int:
+        """The DFA state reached from a given DFA state by consuming a character from the given class."""
+        next_state = self.transitions[state][id]
+        if next_state < 0:
+            states = self.state_sets[state]
+            targets = self.nfa.step(states, self.alphabet.representatives[id])
+            if len(self.state_sets) >= self.max_states:
+                logger.debug("Flushing lazy DFA cache with %d states", len(self.state_sets))
+                self.flush()
+                state = self.state_id(states)
+            next_state = self.state_id(targets)
+            self.transitions[state][id] = next_state
+        return next_state
+
+    def match(self, string: str) -> bool:
+        """Whether the DFA accepts a string input."""
+        state, transitions, dead = self.start, self.transitions, self.dead
+        table, size, astral = self.alphabet.table, len(self.alphabet.table), self.alphabet.astral
+        for c in string:
+            code = ord(c)
+            id = table[code] if code < size else astral.get(c, 0)
+            next_state = transitions[state][id]
+            if next_state < 0:
+                next_state = self.step_class(state, id)
+                transitions = self.transitions
+            state = next_state
+            if state == dead:
+                return False
+        return self.accepting[state]
+
+
+class BitParallelNFA:
+    """Bit-parallel simulation of a compiled NFA, with the set of current states held as an integer bitmask.
+    Characters are grouped using the NFA's alphabet classes (class 0 being characters that only use *-moves).
+    Each class has lookup tables giving the ε-expanded targets of every combination of states in each 8-state chunk,
+    so each step needs just one table lookup per chunk. The tables are generated the first time a class is seen."""
+
+    def __init__(self, nfa: CompiledNFA):
+        self.nfa = nfa
+        closures = [sum(1 << t for t in nfa.closure(s)) for s in range(len(nfa))]
+        other = [reduce(operator.or_, (closures[t] for t in nfa.all_moves(s)), 0) for s in range(len(nfa))]
+        self.alphabet = nfa.alphabet()
+        self.moves: List[List[int]] = [other, *(list(other) for _ in range(len(self.alphabet) - 1))]
+        for s in range(len(nfa)):
+            for c, ts in nfa.char_moves(s).items():
+                id = self.alphabet[c]
+                if c == self.alphabet.representatives[id]:
+                    self.moves[id][s] = reduce(operator.or_, (closures[t] for t in ts), 0)
+        self.tables: List[Optional[List[List[int]]]] = [None] * len(self.moves)
+        self.start = closures[nfa.start]
+        self.end = 1 << nfa.end
+
+    def __repr__(self) -> str:
+        return f"BitParallelNFA(states={len(self.nfa)}, classes={len(self.moves)})"
+
+    def table(self, id: int) -> List[List[int]]:
+        """The chunked lookup tables for a character class."""
+        tables = self.tables[id]
+        if tables is None:
+            row = self.moves[id] + [0] * (-len(self.moves[id]) % 8)
+            tables = self.tables[id] = []
+            for chunk in range(0, len(row), 8):
+                table = [0] * 256
+                for bits in range(1, 256):
+                    # combine the table entry without the lowest bit with that bit's targets
+                    table[bits] = table[bits & (bits - 1)] | row[chunk + (bits & -bits).bit_length() - 1]
+                tables.append(table)
+        return tables
+
+    def match(self, string: str) -> bool:
+        """Whether the NFA accepts a string input."""
+        states, all_tables = self.start, self.tables
+        table, size, astral = self.alphabet.table, len(self.alphabet.table), self.alphabet.astral
+        for c in string:
+            code = ord(c)
+            id = table[code] if code < size else astral.get(c, 0)
+            tables = all_tables[id] or self.table(id)
+            next_states, chunk = 0, 0
+            while states:
+                next_states |= tables[chunk][states & 255]
+                states >>= 8
+                chunk += 1
+            if not next_states:
+                return False
+            states = next_states
+        return bool(states & self.end)
+
+
+class TaggedLazyDFA(LazyDFA):
+    """Lazily constructed DFA whose states are labelled with the tags of the NFA states they contain.
+    Used to match the union of several NFAs while keeping track of which ones accepted."""
+
+    def __init__(self, nfa: CompiledNFA, tags: Dict[int, int], max_states: int = LAZY_DFA_CACHE_SIZE):
+        self.state_tags = tags
+        super().__init__(nfa, max_states)
+
+    def flush(self) -> None:
+        self.tags: List[FrozenSet[int]] = []
+        super().flush()
+
+    def state_id(self, states: FrozenSet[int]) -> int:
+        id = super().state_id(states)
+        if id == len(self.tags):
+            self.tags.append(frozenset(self.state_tags[s] for s in states if s in self.state_tags))
+        return id
+
+    def match_tags(self, string: str) -> FrozenSet[int]:
+        """The tags of the accepting states reached by a string input."""
+        state = self.start
+        for c in string:
+            state = self.step(state, c)
+            if state == self.dead:
+                return frozenset()
+        return self.tags[state]
+
+
+class MatchCounter:
+    """Counts, samples and enumerates the strings matched by an NFA, using dynamic programming over a lazily generated DFA.
+    Since *-moves match any character, they are restricted to a finite alphabet (in addition to any explicit characters).
+    Characters in the same alphabet class of the NFA all behave identically, so are handled as a single weighted class."""
+
+    def __init__(self, nfa: NFA, alphabet: str = EXAMPLE_ALPHABET):
+        compiled = nfa.compiled()
+        explicit = sorted({chr(c) for c in compiled.chars})
+        others = sorted(set(alphabet) - set(explicit))
+        self.alphabet = sorted(explicit + others)
+        groups: Dict[int, str] = {}
+        for c in self.alphabet:
+            id = compiled.alphabet()[c]
+            groups[id] = groups.get(id, "") + c
+        self.classes: List[str] = list(groups.values())
+        self.representative = {c: cls[0] for cls in self.classes for c in cls}
+        # the DFA cache must not be flushed, as the counts are indexed by DFA state
+        self.dfa = LazyDFA(compiled, max_states=sys.maxsize)
+        self.tables: Dict[int, List[Dict[int, int]]] = {}
+
+    def __repr__(self) -> str:
+        return f"MatchCounter(alphabet={len(self.alphabet)}, classes={len(self.classes)}, dfa={self.dfa})"
+
+    def table(self, length: int) -> List[Dict[int, int]]:
+        """For each i <= length, the number of ways of completing a match of the given length from the DFA states reachable after i characters."""
+        if length not in self.tables:
+            levels = [{self.dfa.start}]
+            for _ in range(length):
+                levels.append({t for s in levels[-1] for cls in self.classes for t in [self.dfa.step(s, cls[0])] if t != self.dfa.dead})
+            table = [{s: int(self.dfa.accepting[s]) for s in levels[-1]}]
+            for level in reversed(levels[:-1]):
+                table.append({s: sum(len(cls) * table[-1].get(self.dfa.step(s, cls[0]), 0) for cls in self.classes) for s in level})
+            self.tables[length] = table[::-1]
+        return self.tables[length]
+
+    def count(self, length: int) -> int:
+        """The number of matches of the given length."""
+        return self.table(length)[0][self.dfa.start]
+
+    def sample(self, length: int) -> Optional[str]:
+        """A uniformly random match of the given length (or None if there isn't one)."""
+        table = self.table(length)
+        if not table[0][self.dfa.start]:
+            return None
+        output, state = "", self.dfa.start
+        for i in range(length):
+            weights = [len(cls) * table[i + 1].get(self.dfa.step(state, cls[0]), 0) for cls in self.classes]
+            cls = random.choices(self.classes, weights)[0]
+            output += random.choice(cls)
+            state = self.dfa.step(state, cls[0])
+        return output
+
+    def enumerate(self, length: int, offset: int = 0) -> Iterator[str]:
+        """The matches of the given length in lexicographic order, skipping the first offset ones."""
+        table = self.table(length)
+        if offset >= table[0][self.dfa.start]:
+            return
+        # depth-first search, using the counts to prune dead ends and skip over the first offset matches
+        prefix: List[str] = []
+        stack = [[self.dfa.start, 0]]
+        while stack:
+            depth, descended = len(stack) - 1, False
+            if depth == length:
+                yield "".join(prefix)
+            else:
+                state, first_char = stack[-1]
+                for n in range(first_char, len(self.alphabet)):
+                    t = self.dfa.step(state, self.representative[self.alphabet[n]])
+                    count = table[depth + 1].get(t, 0)
+                    if count > offset:
+                        stack[-1][1] = n + 1
+                        stack.append([t, 0])
+                        prefix.append(self.alphabet[n])
+                        descended = True
+                        break
+                    offset -= count
+            if not descended:
+                stack.pop()
+                del prefix[-1:]
+
+
+class BatchMatcher:
+    """Matches batches of strings at once using NumPy. The strings are encoded as a padded matrix of character indices, and
+    each column is then matched in a single step by indexing into a DFA transition table, whose columns are the NFA's
+    alphabet classes. The table is filled in lazily from a DFA (whose cache is never flushed), so Python-level work is
+    only needed for previously unseen transitions."""
+
+    def __init__(self, nfa: NFA):
+        self.dfa = LazyDFA(nfa.compiled(), max_states=sys.maxsize)
+        self.class_ids = np.array(self.dfa.alphabet.table, dtype=np.int32)
+        self.table = np.full((16, len(self.dfa.alphabet)), -1, dtype=np.int32)
+
+    def __repr__(self) -> str:
+        return f"BatchMatcher(classes={self.table.shape[1]}, dfa={self.dfa})"
+
+    def grow(self, rows: int) -> None:
+        """Ensure the transition table has at least the given number of rows (DFA states)."""
+        old_rows = self.table.shape[0]
+        if rows > old_rows:
+            table = np.full((max(rows, 2 * old_rows), self.table.shape[1]), -1, dtype=np.int32)
+            table[:old_rows] = self.table
+            self.table = table
+
+    def class_indices(self, codes: "np.ndarray") -> "np.ndarray":
+        """Convert an array of code points into table column indices."""
+        outside = codes >= len(self.class_ids)
+        if not outside.any():
+            return self.class_ids[codes]
+        ids = self.class_ids[np.where(outside, 0, codes)]
+        ids[outside] = [self.dfa.alphabet.astral.get(chr(c), 0) for c in codes[outside].tolist()]
+        return ids
+
+    def fill(self, states: "np.ndarray", classes: "np.ndarray") -> None:
+        """Fill in the table entries for the given state and class index pairs."""
+        columns = self.table.shape[1]
+        for pair in np.unique(states * columns + classes):
+            state, id = divmod(int(pair), columns)
+            target = self.dfa.step_class(state, id)
+            self.grow(target + 1)
+            self.table[state, id] = target
+
+    def match(self, strings: Sequence[str]) -> "np.ndarray":
+        """Boolean array indicating which strings are matched (with any non-string values treated as non-matches)."""
+        result = np.zeros(len(strings), dtype=bool)
+        for start in range(0, len(strings), BATCH_SIZE):
+            batch = [(n, s) for n, s in enumerate(strings[start : start + BATCH_SIZE]) if isinstance(s, str)]
+            indices = np.array([n for n, _ in batch], dtype=np.int64)
+            # encode the code points directly, as NumPy's fixed-width string type would strip trailing NULs
+            codes = np.frombuffer("".join(s for _, s in batch).encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+            lengths = np.array([len(s) for _, s in batch], dtype=np.int64)
+            # sort by decreasing length, so that the strings still being matched at each step are always a prefix
+            order = np.argsort(-lengths, kind="stable")
+            offsets = (np.cumsum(lengths) - lengths)[order]
+            width = max(int(lengths.max(initial=0)), 1)
+            active = np.searchsorted(-lengths[order], -np.arange(width), side="left")
+            states = np.full(len(batch), self.dfa.start, dtype=np.int32)
+            for i in range(width):
+                current, column = states[: active[i]], self.class_indices(codes[offsets[: active[i]] + i])
+                targets = self.table.ravel()[current * self.table.shape[1] + column]
+                missing = targets < 0
+                if missing.any():
+                    self.fill(current[missing], column[missing])
+                    targets = self.table.ravel()[current * self.table.shape[1] + column]
+                states[: active[i]] = targets
+            result[start + indices[order]] = np.array(self.dfa.accepting, dtype=bool)[states]
+        return result
+
+
+class Searcher:
+    """Finds the substrings of a text that match an NFA. A single left-to-right pass of a lazy DFA for .*A finds the
+    offsets where matches end, and a lazy DFA for the reversed NFA then runs backwards from these to find the leftmost
+    start. For non-overlapping matches, the NFA's own lazy DFA then runs forwards from there to find the longest match."""
+
+    def __init__(self, nfa: NFA):
+        self.forward = LazyDFA(CompiledNFA(MatchAfter(MatchRepeated(MatchNotIn(""), repeat=True, optional=True), nfa)))
+        self.backward = LazyDFA(CompiledNFA(MatchReversed(nfa)))
+        self.anchored = nfa.lazy_dfa()
+        self.max_length = nfa.max_length()
+
+    def __repr__(self) -> str:
+        return f"Searcher(forward={self.forward}, backward={self.backward})"
+
+    def ends(self, text: str) -> Iterator[int]:
+        """The offsets where matches end."""
+        dfa = self.forward
+        state = dfa.start
+        if dfa.accepting[state]:
+            yield 0
+        for i, c in enumerate(text):
+            state = dfa.step(state, c)
+            if dfa.accepting[state]:
+                yield i + 1
+
+    def start(self, text: str, end: int, limit: int = 0) -> Optional[int]:
+        """The leftmost start, no earlier than limit, of a non-empty match ending at the given offset."""
+        dfa = self.backward
+        state, start = dfa.start, None
+        if self.max_length is not None:
+            limit = max(limit, end - self.max_length)
+        for i in range(end - 1, limit - 1, -1):
+            state = dfa.step(state, text[i])
+            if state == dfa.dead:
+                break
+            elif dfa.accepting[state]:
+                start = i
+        return start
+
+    def end(self, text: str, start: int) -> int:
+        """The end of the longest match starting at the given offset (which must be the start of some match)."""
+        dfa = self.anchored
+        state, end = dfa.start, start
+        stop = len(text) if self.max_length is None else min(len(text), start + self.max_length)
+        for i in range(start, stop):
+            state = dfa.step(state, text[i])
+            if state == dfa.dead:
+                break
+            elif dfa.accepting[state]:
+                end = i + 1
+        return end
+
+    def search(self, text: str, overlapping: bool = False) -> Iterator[Tuple[int, int]]:
+        """The (start, end) offsets of the matching non-empty substrings. By default, these are the non-overlapping
+        matches found by taking the leftmost start of the earliest ending match, and then extending it to the longest
+        match from there (which, like grep, finds the leftmost-longest match except when a match that starts earlier
+        also ends later). If overlapping is set, then the longest match ending at each offset is returned instead."""
+        last = 0
+        for end in self.ends(text):
+            if overlapping:
+                start = self.start(text, end)
+            elif end > last:
+                start = self.start(text, end, last)
+                if start is not None:
+                    end = last = self.end(text, start)
+            else:
+                continue
+            if start is not None:
+                yield start, end
+
+
+class Prefilter:
+    """Cheap necessary conditions for a string to match an NFA, used to reject most strings before running it:
+    - the possible match lengths
+    - the possible first and last characters (or, if negated, the impossible ones)
+    - a mandatory prefix and suffix
+    - mandatory literal substrings"""
+
+    MAX_LITERAL_LENGTH = 8
+    MAX_LITERAL_TESTS = 64
+
+    def __init__(self, nfa: NFA):
+        compiled = nfa.compiled()
+        self.min_length = compiled.min_length()
+        self.max_length = compiled.max_length()
+        self.lengths = compiled.length_spectrum()
+        if self.min_length is None:
+            self.prefix = self.suffix = ""
+            self.first_chars, self.last_chars = (frozenset(), False), (frozenset(), False)
+            self.literals: List[str] = []
+            return
+        self.prefix, self.first_chars = self.prefix_chars(compiled)
+        self.suffix, self.last_chars = self.suffix_chars(compiled)
+        self.literals = self.mandatory_literals(compiled)
+
+    def __repr__(self) -> str:
+        return (
+            f"Prefilter(lengths={self.lengths!r}, prefix={self.prefix!r}, suffix={self.suffix!r}, "
+            f"first_chars={self.first_chars}, last_chars={self.last_chars}, literals={self.literals})"
+        )
+
+    def __call__(self, string: str) -> bool:
+        """Whether a string passes the filter (and so might match the NFA)."""
+        if len(string) not in self.lengths:
+            return False
+        elif string and ((string[0] in self.first_chars[0]) == self.first_chars[1] or (string[-1] in self.last_chars[0]) == self.last_chars[1]):
+            return False
+        elif not string.startswith(self.prefix) or not string.endswith(self.suffix):
+            return False
+        return all(literal in string for literal in self.literals)
+
+    @staticmethod
+    def char_set(nfa: CompiledNFA, allowed: Set[str], all_sources: Set[int]) -> Tuple[FrozenSet[str], bool]:
+        """Combine explicitly allowed characters with those allowed by *-moves from the given states,
+        returning them as a set along with whether the set is negated."""
+        if not all_sources:
+            return frozenset(allowed), False
+        # *-moves allow any character other than the explicit ones
+        blocked = set.intersection(*(set(nfa.char_moves(s)) for s in all_sources))
+        return frozenset(blocked - allowed), True
+
+    @classmethod
+    def prefix_chars(cls, nfa: CompiledNFA) -> Tuple[str, Tuple[FrozenSet[str], bool]]:
+        """The mandatory prefix and possible first characters of the NFA's matches."""
+        live = nfa.live_states()
+
+        def next_chars(states: Iterable[int]) -> Tuple[FrozenSet[str], bool]:
+            allowed = {c for s in states for c, ts in nfa.char_moves(s).items() if any(t in live for t in ts)}
+            return cls.char_set(nfa, allowed, {s for s in states if any(t in live for t in nfa.all_moves(s))})
+
+        states = nfa.expand_epsilons({nfa.start}) & live
+        first_chars = chars = next_chars(states)
+        prefix = ""
+        while nfa.end not in states and not chars[1] and len(chars[0]) == 1 and len(prefix) < cls.MAX_LITERAL_LENGTH:
+            c = first(chars[0])
+            prefix += c
+            states = nfa.step(states, c) & live
+            chars = next_chars(states)
+        return prefix, first_chars
+
+    @classmethod
+    def suffix_chars(cls, nfa: CompiledNFA) -> Tuple[str, Tuple[FrozenSet[str], bool]]:
+        """The mandatory suffix and possible last characters of the NFA's matches."""
+        live, sources = nfa.live_states(), nfa.sources()
+
+        def expand_epsilons(states: Iterable[int]) -> Set[int]:
+            expanded, todo = set(states), list(states)
+            while todo:
+                for s, i in sources[todo.pop()]:
+                    if i == input_code(Move.EMPTY) and s in live and s not in expanded:
+                        expanded.add(s)
+                        todo.append(s)
+            return expanded
+
+        def previous_chars(states: Iterable[int]) -> Tuple[FrozenSet[str], bool]:
+            moves = [(s, i) for t in states for s, i in sources[t] if s in live]
+            allowed = {chr(i) for _, i in moves if i >= 0}
+            return cls.char_set(nfa, allowed, {s for s, i in moves if i == input_code(Move.ALL)})
+
+        states = expand_epsilons({nfa.end} & live)
+        last_chars = chars = previous_chars(states)
+        suffix = ""
+        while nfa.start not in states and not chars[1] and len(chars[0]) == 1 and len(suffix) < cls.MAX_LITERAL_LENGTH:
+            c = first(chars[0])
+            suffix = c + suffix
+            states = expand_epsilons({s for t in states for s, _ in sources[t] if s in live and t in nfa.moves(s, c)})
+            chars = previous_chars(states)
+        return suffix, last_chars
+
+    @staticmethod
+    def mandatory_chars(nfa: CompiledNFA, live: Set[int]) -> str:
+        """The characters that are consumed on every path from the start to the end."""
+        # calculate the greatest fixpoint of M(s) = ∩ { M(t) ∪ chars(s→t) }, using ints as bitsets:
+        # since the values only ever shrink, we can push each change back along the incoming moves
+        sources = nfa.sources()
+        alphabet = sorted({chr(i) for t in live for s, i in sources[t] if i >= 0 and s in live})
+        bits = {ord(c): 1 << n for n, c in enumerate(alphabet)}
+        mandatory = dict.fromkeys(live, (1 << len(alphabet)) - 1)
+        mandatory[nfa.end] = 0
+        todo = [nfa.end]
+        while todo:
+            t = todo.pop()
+            for s, i in sources[t]:
+                if s in live:
+                    value = mandatory[s] & (mandatory[t] | bits.get(i, 0))
+                    if value != mandatory[s]:
+                        mandatory[s] = value
+                        todo.append(s)
+        return "".join(c for c in alphabet if mandatory[nfa.start] & bits[ord(c)])
+
+    @staticmethod
+    def avoidable(nfa: CompiledNFA, live: Set[int], literal: str) -> bool:
+        """Whether the NFA matches any string that doesn't contain the given literal."""
+        # search the product of the NFA with the KMP automaton for the literal
+        failure = [0] * len(literal)
+        k = 0
+        for i in range(1, len(literal)):
+            while k and literal[i] != literal[k]:
+                k = failure[k - 1]
+            if literal[i] == literal[k]:
+                k += 1
+            failure[i] = k
+
+        def advance(k: int, c: str) -> int:
+            while k and literal[k] != c:
+                k = failure[k - 1]
+            return k + 1 if literal[k] == c else 0
+
+        chars = set(literal)
+        visited = {(s, 0) for s in nfa.closure(nfa.start) if s in live}
+        todo = list(visited)
+        while todo:
+            s, k = todo.pop()
+            if s == nfa.end:
+                return True
+            moves: List[Tuple[int, int]] = []
+            explicit = nfa.char_moves(s)
+            for c, ts in explicit.items():
+                moves.extend((t, advance(k, c)) for t in ts)
+            for t in nfa.all_moves(s):
+                moves.append((t, 0))
+                moves.extend((t, advance(k, c)) for c in chars if c not in explicit)
+            for t, k2 in moves:
+                if t in live and k2 < len(literal):
+                    for u in nfa.closure(t):
+                        if u in live and (u, k2) not in visited:
+                            visited.add((u, k2))
+                            todo.append((u, k2))
+        return False
+
+    @classmethod
+    def mandatory_literals(cls, nfa: CompiledNFA) -> List[str]:
+        """Mandatory literal substrings, found by greedily extending the mandatory characters."""
+        live = nfa.live_states()
+        chars = cls.mandatory_chars(nfa, live)
+        literals: List[str] = []
+        tests = 0
+        for literal in chars:
+            if any(literal in l for l in literals):
+                continue
+            extended = True
+            while extended and len(literal) < cls.MAX_LITERAL_LENGTH:
+                extended = False
+                for candidate in [literal + c for c in chars] + [c + literal for c in chars]:
+                    if tests >= cls.MAX_LITERAL_TESTS:
+                        break
+                    tests += 1
+                    if not cls.avoidable(nfa, live, candidate):
+                        literal, extended = candidate, True
+                        break
+            literals = [l for l in literals if l not in literal] + [literal]
+        return literals
+
+
+class ProfileNode:
+    """Construction statistics for a single NFA constructor call."""
+
+    def __init__(self, name: str, args: str, input_states: int, input_transitions: int):
+        self.name = name
+        self.args = args
+        self.input_states = input_states
+        self.input_transitions = input_transitions
+        self.states = 0
+        self.transitions = 0
+        self.seconds = 0.0
+        self.trimmed_states = 0
+        self.trimmed_transitions = 0
+        self.children: List["ProfileNode"] = []
+
+    def __repr__(self) -> str:
+        return f"ProfileNode({self.name}({self.args}), states={self.states}, seconds={self.seconds:.4f})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**{k: v for k, v in vars(self).items() if k != "children"}, "children": [c.to_dict() for c in self.children]}
+
+    def report(self, indent: int = 0) -> List[str]:
+        inputs = f" from {self.input_states} states, {self.input_transitions} transitions" if self.input_states else ""
+        trimmed = f", trimmed {self.trimmed_states} states, {self.trimmed_transitions} transitions" if self.trimmed_states or self.trimmed_transitions else ""
+        line = f"{'  ' * indent}{self.name}({self.args}): {self.states} states, {self.transitions} transitions{inputs} in {self.seconds:.4f}s{trimmed}"
+        return [line, *(l for c in self.children for l in c.report(indent + 1))]
+
+
+class Profiler:
+    """Context manager that records a tree of NFA constructor statistics (see profiled).
+    Each node's children are the constructors that built its input NFAs, followed by any constructors it called itself."""
+
+    def __init__(self):
+        self.roots: List[ProfileNode] = []
+        self._stack: List[ProfileNode] = []
+        self._outputs: Dict[int, Tuple[NFA, ProfileNode, List[ProfileNode]]] = {}
+        self._previous: Optional[Profiler] = None
+
+    def __repr__(self) -> str:
+        return f"Profiler({len(self.roots)} roots)"
+
+    def __enter__(self) -> "Profiler":
+        global PROFILER
+        self._previous, PROFILER = PROFILER, self
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        global PROFILER
+        PROFILER = self._previous
+        self._outputs.clear()
+
+    @staticmethod
+    def describe(arg: Any) -> str:
+        if isinstance(arg, (set, frozenset)):
+            return f"<{len(arg)} states>"
+        r = repr(arg)
+        return r if len(r) <= 20 else r[:17] + "..."
+
+    def call(self, fn: Callable[..., NFA], args: Sequence[Any], kwargs: Dict[str, Any]) -> NFA:
+        inputs = [a for a in (*args, *kwargs.values()) if isinstance(a, NFA)]
+        arguments = inspect.signature(fn).bind(*args, **kwargs).arguments
+        params = [
+            f"{k}={self.describe(v)}" for k, v in arguments.items() if not isinstance(v, NFA) and not (isinstance(v, tuple) and v and isinstance(v[0], NFA))
+        ]
+        node = ProfileNode(fn.__name__, ", ".join(params), 0, 0)
+        for nfa in inputs:
+            node.input_states += len(nfa.states)
+            node.input_transitions += len(nfa.transitions)
+            _, child, siblings = self._outputs.pop(id(nfa), (None, None, None))
+            if child is not None and siblings is not None and any(c is child for c in siblings):
+                siblings.remove(child)
+                node.children.append(child)
+        if inputs:
+            logger.info(f"Constructing {node.name}({node.args}) from {node.input_states} states")
+        siblings = self._stack[-1].children if self._stack else self.roots
+        self._stack.append(node)
+        start = time.perf_counter()
+        try:
+            nfa = fn(*args, **kwargs)
+        finally:
+            node.seconds = time.perf_counter() - start
+            self._stack.pop()
+            siblings.append(node)
+        node.states, node.transitions = len(nfa.states), len(nfa.transitions)
+        self._outputs[id(nfa)] = (nfa, node, siblings)
+        return nfa
+
+    def trimmed(self, states: int, transitions: int) -> None:
+        if self._stack:
+            self._stack[-1].trimmed_states += states
+            self._stack[-1].trimmed_transitions += transitions
+
+    def report(self) -> str:
+        return "\n".join(l for r in self.roots for l in r.report())
+
+
+def profiled(fn: Callable[..., NFA]) -> Callable[..., NFA]:
+    """Decorator for NFA constructors that records their statistics while a Profiler is active."""
+
+    @wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> NFA:
+        if PROFILER is None:
+            return fn(*args, **kwargs)
+        return PROFILER.call(fn, args, kwargs)
+
+    return wrapper
+
+
+def input_code(input: Input) -> int:
+    """Integer encoding of an NFA input, as used by the binary FSM format."""
+    return -1 if input == Move.EMPTY else -2 if input == Move.ALL else ord(input)
+
+
+def input_from_code(code: int) -> Input:
+    """Inverse of input_code."""
+    return Move.EMPTY if code == -1 else Move.ALL if code == -2 else chr(code)
 
 
 def char_class(chars: str, negated: bool = False) -> str:
@@ -378,50 +1666,126 @@ def new_states(*names: str) -> List[Callable[..., State]]:
 # NFA constructors
 def merge_trans(*args):
     """Merge multiple transitions, unioning target states."""
-    return merge_with(lambda x: set.union(*x), *args)
+    merged: Dict[Any, Set[Any]] = {}
+    for d in args:
+        for k, v in d.items():
+            merged[k] = merged[k] | v if k in merged else set(v)
+    return merged
+
+
+def first(iterable: Iterable[Any], default: Any = None) -> Any:
+    """The first element of an iterable, or a default if there aren't any."""
+    return next(iter(iterable), default)
 
 
+@profiled
 def MatchEmpty() -> NFA:
     """Empty match"""
     return NFA("1", "2", {("1", Move.EMPTY): {"2"}})
 
 
+@profiled
 def MatchIn(characters: str) -> NFA:
     """Handles: a, [abc]"""
     return NFA("1", "2", {("1", c): {"2"} for c in characters})
 
 
+@profiled
 def MatchNotIn(characters: str) -> NFA:
     """Handles: [^abc], ."""
     return NFA("1", "2", merge_trans({("1", Move.ALL): {"2"}}, {("1", c): set() for c in characters}))
 
 
+@profiled
 def MatchWords(words: Iterable[str]) -> NFA:
-    # generate a prefix tree
-    start, end = ("0",), ("1",)
+    """Generate a minimal acyclic word automaton (DAWG) with integer states, using the incremental algorithm
+    for sorted input from Daciuk et al. States are shared between words with the same suffixes."""
+    edges: List[Dict[str, int]] = [{}]
+    final: List[bool] = [False]
+    register: Dict[Tuple[bool, Tuple[Tuple[str, int], ...]], int] = {}
+    unchecked: List[Tuple[int, str, int]] = []  # path of the last word inserted that still needs minimising
+
+    def minimise(down_to: int) -> None:
+        while len(unchecked) > down_to:
+            parent, char, child = unchecked.pop()
+            signature = (final[child], tuple(sorted(edges[child].items())))
+            if signature in register:
+                edges[parent][char] = register[signature]
+            else:
+                register[signature] = child
+
+    previous = ""
+    for word in sorted(set(words)):
+        if not word:
+            continue
+        common = 0
+        for c1, c2 in zip(word, previous):
+            if c1 != c2:
+                break
+            common += 1
+        minimise(common)
+        state = unchecked[-1][2] if unchecked else 0
+        for c in word[common:]:
+            edges.append({})
+            final.append(False)
+            edges[state][c] = len(edges) - 1
+            unchecked.append((state, c, len(edges) - 1))
+            state = len(edges) - 1
+        final[state] = True
+        previous = word
+    minimise(0)
+
+    # renumber the reachable states, with 0 for the start and 1 for a separate end state
+    numbering = {0: 0}
+    todo = [0]
+    while todo:
+        for t in edges[todo.pop()].values():
+            if t not in numbering:
+                numbering[t] = len(numbering) + 1
+                todo.append(t)
     transitions: Transitions = {}
-    for word in words:
-        for i in range(len(word)):
-            transitions.setdefault((word[:i] or start, word[i]), set()).add(word[: i + 1])
-        transitions[(word, Move.EMPTY)] = {end}
-    return NFA(start, end, transitions)
+    for s, n in numbering.items():
+        for c, t in edges[s].items():
+            transitions[(n, c)] = {numbering[t]}
+        if final[s]:
+            transitions[(n, Move.EMPTY)] = {1}
+    return NFA(0, 1, transitions)
+
 
+def load_binary_nfa(path: Path) -> Optional[NFA]:
+    """Load an NFA from a binary FSM file (as generated by to_bytes), which is much faster to decode than the text format.
+    Returns None if the file isn't in the binary format."""
+    data = Path(path).read_bytes()
+    return NFA.from_bytes(data) if data.startswith(NFA_MAGIC) else None
 
+
+@profiled
 def MatchDictionary(path: Path) -> NFA:
     r"""Handles: \w"""
+    nfa = load_binary_nfa(path)
+    if nfa is not None:
+        return nfa
     with open(str(path), "r", encoding="utf-8") as f:
         return MatchWords(w.rstrip("\n") for w in f)
 
 
+@profiled
 def ExplicitFSM(path: Path) -> NFA:
     r"""Handles: \f"""
+    from pyparsing import srange
+
+    nfa = load_binary_nfa(path)
+    if nfa is not None:
+        return nfa
     transitions: Transitions = {}
+    captures: Captures = {}
     with open(str(path), "r", encoding="utf-8") as f:
         for line in f:
             args = line.split()
             if args:
                 x: Input
                 start, x, *end = args
+                groups = set(end.pop()[1:-1].split(",")) if end and end[-1].startswith("{") else set()
                 if start == "END":
                     raise ValueError("END state should have no outbound arrows")
                 elif "START" in end:
@@ -429,28 +1793,32 @@ def ExplicitFSM(path: Path) -> NFA:
                 elif x == "SPACE":
                     x = " "
                 if re.match(r"^\[\^.+]$", x):
-                    transitions.setdefault((start, Move.ALL), set()).update(end)
+                    inputs: List[Input] = [Move.ALL]
                     for x in srange(x):
                         transitions.setdefault((start, x), set())
                 elif re.match(r"^\[.+]$", x):
-                    for x in srange(x):
-                        transitions.setdefault((start, x), set()).update(end)
+                    inputs = list(srange(x))
                 elif x in {"EMPTY", "ALL"}:
-                    x = {"EMPTY": Move.EMPTY, "ALL": Move.ALL}[x]
-                    transitions.setdefault((start, x), set()).update(end)
+                    inputs = [{"EMPTY": Move.EMPTY, "ALL": Move.ALL}[x]]
                 elif len(x) > 1:
                     raise ValueError(f"Unexpected FSM input `{x}`: should be character, class, ALL or EMPTY")
                 else:
-                    transitions.setdefault((start, x), set()).update(end)
-    return NFA("START", "END", transitions)
+                    inputs = [x]
+                for i in inputs:
+                    transitions.setdefault((start, i), set()).update(end)
+                    if groups and i != Move.EMPTY:
+                        captures.setdefault((start, i), set()).update(groups)
+    return NFA("START", "END", transitions, captures)
 
 
+@profiled
 def MatchCapture(nfa: NFA, id: CaptureGroup) -> NFA:
     """Handles: (?<id>A)"""
     captures = {(s, i): {id} for (s, i) in nfa.transitions if i != Move.EMPTY}
     return NFA(nfa.start, nfa.end, nfa.transitions, merge_trans(nfa.captures, captures))
 
 
+@profiled
 def MatchAfter(nfa1: NFA, nfa2: NFA) -> NFA:
     """Handles: AB"""
     First, Second = new_states("a", "b")
@@ -464,6 +1832,7 @@ def MatchAfter(nfa1: NFA, nfa2: NFA) -> NFA:
     return NFA(First(nfa1.start), Second(nfa2.end), merge_trans(t1, t2), merge_trans(c1, c2))
 
 
+@profiled
 def MatchEither(*nfas: NFA) -> NFA:
     """Handles: A|B (and arbitrary alternation too)"""
     Start, End, *Option = new_states("a", "z", *[str(n) for n in range(1, len(nfas) + 1)])
@@ -476,6 +1845,7 @@ def MatchEither(*nfas: NFA) -> NFA:
     return NFA(Start(), End(), merge_trans(tstart, tend, *tis), merge_trans(*cis))
 
 
+@profiled
 def MatchRepeated(nfa: NFA, repeat: bool = False, optional: bool = False) -> NFA:
     """Handles: A*, A+, A?"""
     Start, End, Star = new_states("a", "z", "*")
@@ -490,30 +1860,48 @@ def MatchRepeated(nfa: NFA, repeat: bool = False, optional: bool = False) -> NFA
     return NFA(Start(), End(), transitions, captures)
 
 
+@profiled
 def MatchRepeatedN(nfa: NFA, minimum: int, maximum: int) -> NFA:
     """Handles: A{2,5}"""
     if minimum == maximum == 0:
         return MatchEmpty()
     elif minimum == maximum == 1:
         return nfa
-    elif minimum > 0:
-        return MatchAfter(nfa, MatchRepeatedN(nfa, minimum - 1, maximum - 1))
     elif maximum == 1:
         return MatchRepeated(nfa, optional=True)
-    else:
-        return MatchRepeated(MatchAfter(nfa, MatchRepeatedN(nfa, 0, maximum - 1)), optional=True)
+    # chain together copies of the NFA, with empty moves to the end from the start of the optional ones
+    End, *Copy = new_states("z", *[str(n) for n in range(1, maximum + 1)])
+    transitions, captures = chain_copies(nfa, Copy)
+    transitions[(Copy[-1](nfa.end), Move.EMPTY)] = {End()}
+    for n in range(minimum, maximum):
+        transitions.setdefault((Copy[n](nfa.start), Move.EMPTY), set()).add(End())
+    return NFA(Copy[0](nfa.start), End(), transitions, captures)
 
 
+@profiled
 def MatchRepeatedNplus(nfa: NFA, minimum: int) -> NFA:
     """Handles: A{2,}"""
     if minimum == 0:
         return MatchRepeated(nfa, repeat=True, optional=True)
     elif minimum == 1:
         return MatchRepeated(nfa, repeat=True)
-    else:
-        return MatchAfter(nfa, MatchRepeatedNplus(nfa, minimum - 1))
+    # chain together copies of the NFA, with the last one repeatable
+    End, *Copy = new_states("z", *[str(n) for n in range(1, minimum + 1)])
+    transitions, captures = chain_copies(nfa, Copy)
+    transitions[(Copy[-1](nfa.end), Move.EMPTY)] = {End(), Copy[-1](nfa.start)}
+    return NFA(Copy[0](nfa.start), End(), transitions, captures)
 
 
+def chain_copies(nfa: NFA, Copy: Sequence[Callable[..., State]]) -> Tuple[Transitions, Captures]:
+    """Transitions and captures for copies of an NFA, with empty moves from the end of each copy to the start of the next."""
+    transitions: Transitions = {(C(s), i): {C(t) for t in ts} for C in Copy for (s, i), ts in nfa.transitions.items()}
+    captures: Captures = {(C(s), i): cs for C in Copy for (s, i), cs in nfa.captures.items()}
+    for C, D in zip(Copy, Copy[1:]):
+        transitions[(C(nfa.end), Move.EMPTY)] = {D(nfa.start)}
+    return transitions, captures
+
+
+@profiled
 def MatchLength(minimum: int = 0, maximum: Optional[int] = None) -> NFA:
     if maximum is None:
         return MatchRepeatedNplus(MatchNotIn(""), minimum)
@@ -521,37 +1909,98 @@ def MatchLength(minimum: int = 0, maximum: Optional[int] = None) -> NFA:
         return MatchRepeatedN(MatchNotIn(""), minimum, maximum)
 
 
-def MatchDFA(nfa: NFA, negate: bool) -> NFA:
-    """Handles: (?D:A), ¬A"""
-    if nfa.captures and not negate:
-        raise NotImplementedError("Cannot convert NFA with submatch captures to a DFA")
+DFATransitions = Dict[State, Dict[Input, State]]
 
-    # convert to DFA via powerset construction (and optionally invert accepted/rejected states)
+
+def determinise(nfa: NFA) -> Tuple[State, DFATransitions, Set[State]]:
+    """Convert an NFA to a DFA via powerset construction, returning the start state, transitions and accepting states.
+    DFA states are sorted tuples of NFA states, and missing transitions are rejected. Each target is only calculated
+    once per alphabet class, with Move.ALL sharing the class of characters that only use *-moves."""
+    alphabet = nfa.compiled().alphabet()
     start_state = tuple(sorted(nfa.expand_epsilons({nfa.start}), key=str))
     to_process = [start_state]
-    processed_states = set()
+    transitions: DFATransitions = {start_state: {}}
     accepting_states = set()
-    transitions: Transitions = {}
     while to_process:
         current_state = to_process.pop()
-        processed_states.add(current_state)
         if any(s == nfa.end for s in current_state):
             accepting_states.add(current_state)
-        moves = {i for (s, i) in nfa.transitions if s in current_state and i != Move.EMPTY}
+        moves = {i for s in current_state for i in nfa.outgoing.get(s, {}) if i != Move.EMPTY}
+        class_targets: Dict[int, State] = {}
         for i in moves:
-            next_state = {t for s in current_state for t in nfa.transitions.get((s, i), nfa.transitions.get((s, Move.ALL), set()))}
-            next_state_sorted = tuple(sorted(nfa.expand_epsilons(next_state), key=str))
-            transitions[(current_state, i)] = {next_state_sorted}
-            if next_state_sorted not in processed_states:
+            id = 0 if i == Move.ALL else alphabet[i]
+            next_state_sorted = class_targets.get(id)
+            if next_state_sorted is None:
+                next_state = {t for s in current_state for t in nfa.transitions.get((s, i), nfa.transitions.get((s, Move.ALL), set()))}
+                next_state_sorted = class_targets[id] = tuple(sorted(nfa.expand_epsilons(next_state), key=str))
+            transitions[current_state][i] = next_state_sorted
+            if next_state_sorted not in transitions:
+                transitions[next_state_sorted] = {}
                 to_process.append(next_state_sorted)
+    return start_state, transitions, accepting_states
+
+
+def minimise(transitions: DFATransitions, accepting_states: Set[State]) -> Dict[State, int]:
+    """Minimise a DFA using Hopcroft's partition refinement algorithm, returning the equivalence class of each state.
+    Transitions on Move.ALL are treated as transitions on an 'other' character class, and missing transitions as
+    transitions to an implicit dead state (which is assigned the class -1). Inputs with identical transitions from
+    every state are interchangeable, so only one of each is used for refinement."""
+    dead = object()
+    columns: Dict[Tuple[State, ...], Input] = {}
+    for i in {i for moves in transitions.values() for i in moves}:
+        columns.setdefault(tuple(moves.get(i, moves.get(Move.ALL, dead)) for moves in transitions.values()), i)
+    alphabet = set(columns.values())
+
+    # inverse of the (total) transition function
+    inverse: Dict[Tuple[Input, State], List[State]] = {}
+    for state, moves in transitions.items():
+        other = moves.get(Move.ALL, dead)
+        for i in alphabet:
+            inverse.setdefault((i, moves.get(i, other)), []).append(state)
+    for i in alphabet:
+        inverse.setdefault((i, dead), []).append(dead)
+
+    # start with the accepting and non-accepting states and refine until stable
+    blocks: List[Set[State]] = [b for b in (set(accepting_states), set(transitions) - accepting_states | {dead}) if b]
+    block_of = {s: n for n, b in enumerate(blocks) for s in b}
+    to_process = {(min(range(len(blocks)), key=lambda n: len(blocks[n])), i) for i in alphabet}
+    while to_process:
+        splitter, i = to_process.pop()
+        predecessors: Dict[int, Set[State]] = {}
+        for t in blocks[splitter]:
+            for s in inverse.get((i, t), ()):
+                predecessors.setdefault(block_of[s], set()).add(s)
+        for n, split in predecessors.items():
+            if len(split) < len(blocks[n]):
+                rest = blocks[n] - split
+                smaller, larger = (split, rest) if len(split) <= len(rest) else (rest, split)
+                blocks[n] = larger
+                blocks.append(smaller)
+                for s in smaller:
+                    block_of[s] = len(blocks) - 1
+                to_process |= {(len(blocks) - 1, j) for j in alphabet}
+
+    dead_block = block_of.pop(dead)
+    return {s: -1 if n == dead_block else n for s, n in block_of.items()}
+
+
+@profiled
+def MatchDFA(nfa: NFA, negate: bool) -> NFA:
+    """Handles: (?D:A), ¬A"""
+    if nfa.captures and not negate:
+        raise NotImplementedError("Cannot convert NFA with submatch captures to a DFA")
+
+    # convert to DFA via powerset construction (and optionally invert accepted/rejected states)
+    start_state, dfa, accepting_states = determinise(nfa)
+    transitions: Transitions = {(s, i): {t} for s, moves in dfa.items() for i, t in moves.items()}
 
     # transition accepting/non-accepting states to a single final state
-    for final_state in (processed_states - accepting_states) if negate else accepting_states:
+    for final_state in (set(dfa) - accepting_states) if negate else accepting_states:
         transitions.setdefault((final_state, Move.EMPTY), set()).add("2")
 
     # if negating, transition non-moves to a new accepting, consuming state
     if negate:
-        for state in processed_states:
+        for state in dfa:
             if (state, Move.ALL) not in transitions:
                 transitions[(state, Move.ALL)] = {"1"}
                 transitions.setdefault(("1", Move.ALL), {"1"})
@@ -562,43 +2011,193 @@ def MatchDFA(nfa: NFA, negate: bool) -> NFA:
     return nfa
 
 
+@profiled
+def MatchMinimalDFA(nfa: NFA) -> NFA:
+    """Handles: (?M:A)"""
+    if nfa.captures:
+        raise NotImplementedError("Cannot convert NFA with submatch captures to a DFA")
+
+    # convert to DFA via powerset construction and merge equivalent states
+    start_state, dfa, accepting_states = determinise(nfa)
+    classes = minimise(dfa, accepting_states)
+    representatives = {n: s for s, n in classes.items()}
+    alphabet = {i for moves in dfa.values() for i in moves if i != Move.ALL}
+
+    transitions: Transitions = {}
+    for n, state in representatives.items():
+        if n == -1:
+            continue
+        moves = dfa[state]
+        other = classes[moves[Move.ALL]] if Move.ALL in moves else -1
+        if other != -1:
+            transitions[(state, Move.ALL)] = {representatives[other]}
+        for i in alphabet:
+            target = classes[moves[i]] if i in moves else other
+            if target != other:
+                transitions[(state, i)] = {representatives[target]} if target != -1 else set()
+        if state in accepting_states:
+            transitions[(state, Move.EMPTY)] = {"2"}
+
+    # use a fresh start state if the start class has incoming moves (which NFA.regex doesn't expect)
+    start = representatives[classes[start_state]]
+    if any(start in ts for ts in transitions.values()):
+        transitions[("1", Move.EMPTY)] = {start}
+        start = "1"
+    nfa = NFA(start, "2", transitions)
+    nfa.remove_redundant_states(aggressive=True)
+    return nfa
+
+
+def product_moves(nfa1: NFA, nfa2: NFA, s1: State, s2: State) -> Tuple[Dict[Input, Set[State]], Dict[Input, Set[CaptureGroup]]]:
+    """The moves (and captures) from a pair of states in the cartesian product of two NFAs (with special handling for *-transitions)."""
+    moves1, moves2 = nfa1.outgoing.get(s1, {}), nfa2.outgoing.get(s2, {})
+    moves: Dict[Input, Set[State]] = {}
+    captures: Dict[Input, Set[CaptureGroup]] = {}
+    for i, ts1 in moves1.items():
+        if i == Move.EMPTY:
+            moves.setdefault(i, set()).update(product(ts1, {s2}))
+        else:
+            ts2 = moves2.get(i, moves2.get(Move.ALL))
+            if ts2 is not None:
+                moves[i] = set(product(ts1, ts2))
+                cs2 = nfa1.captures.get((s1, i), set()) | nfa2.captures.get((s2, i), nfa2.captures.get((s2, Move.ALL), set()))
+                if cs2:
+                    captures[i] = cs2
+    for i, ts2 in moves2.items():
+        if i == Move.EMPTY:
+            moves.setdefault(i, set()).update(product({s1}, ts2))
+        elif i not in moves1:  # (as we've done those already!)
+            ts1o = moves1.get(Move.ALL)
+            if ts1o is not None:
+                moves[i] = set(product(ts1o, ts2))
+                cs1o = nfa2.captures.get((s2, i), set()) | nfa1.captures.get((s1, Move.ALL), set())
+                if cs1o:
+                    captures[i] = cs1o
+    return moves, captures
+
+
+def product_reachable(nfa1: NFA, nfa2: NFA, source: State, proper: bool = False) -> Set[State]:
+    """The pairs of states in the cartesian product of two NFAs that are reachable from the source pair (via at least one character if proper)."""
+    to_process = [(source, not proper)]
+    processed = set(to_process)
+    while to_process:
+        (s1, s2), read = to_process.pop()
+        moves, _ = product_moves(nfa1, nfa2, s1, s2)
+        for i, ts in moves.items():
+            for t in ts:
+                node = (t, read or i != Move.EMPTY)
+                if node not in processed:
+                    processed.add(node)
+                    to_process.append(node)
+    return {t for t, read in processed if read}
+
+
+def product_reachability(nfa1: NFA, nfa2: NFA, sources: Iterable[State], sinks: Set[State], proper: bool = False) -> Dict[State, Set[State]]:
+    """For each source pair of states in the cartesian product of two NFAs, the sink pairs that are reachable from it
+    (via at least one character if proper). Calculated in a single traversal of the product, however many sources there are."""
+    # find the strongly connected components using Tarjan's algorithm: these are generated in reverse topological order,
+    # so we can accumulate the reachable sinks (as bitsets) as we go; when proper, nodes also record whether a character was read
+    # (sinks are numbered in the order they're found, which keeps the bitsets short)
+    sink_list: List[State] = []
+    sink_bits: Dict[State, int] = {}
+    index: Dict[Tuple[State, bool], int] = {}
+    lowlink: Dict[Tuple[State, bool], int] = {}
+    component: Dict[Tuple[State, bool], int] = {}
+    edges: Dict[Tuple[State, bool], List[Tuple[State, bool]]] = {}
+    reach: List[int] = []
+    stack: List[Tuple[State, bool]] = []
+
+    def visit(node: Tuple[State, bool]) -> None:
+        index[node] = lowlink[node] = len(index)
+        (s1, s2), read = node
+        moves, _ = product_moves(nfa1, nfa2, s1, s2)
+        edges[node] = list({(t, read or i != Move.EMPTY) for i, ts in moves.items() for t in ts})
+        stack.append(node)
+        work.append((node, 0))
+
+    roots = {source: (source, not proper) for source in sources}
+    for root in roots.values():
+        if root in index:
+            continue
+        work: List[Tuple[Tuple[State, bool], int]] = []
+        visit(root)
+        while work:
+            node, n = work[-1]
+            while n < len(edges[node]):
+                t = edges[node][n]
+                n += 1
+                if t not in index:
+                    work[-1] = (node, n)
+                    visit(t)
+                    break
+                elif t not in component:
+                    lowlink[node] = min(lowlink[node], index[t])
+            else:
+                work.pop()
+                if work:
+                    lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[node])
+                if lowlink[node] == index[node]:
+                    members = []
+                    while True:
+                        t = stack.pop()
+                        component[t] = len(reach)
+                        members.append(t)
+                        if t == node:
+                            break
+                    bits = 0
+                    for m in members:
+                        if m[1] and m[0] in sinks:
+                            if m[0] not in sink_bits:
+                                sink_bits[m[0]] = 1 << len(sink_list)
+                                sink_list.append(m[0])
+                            bits |= sink_bits[m[0]]
+                        for t in edges.pop(m):
+                            if component[t] != len(reach):
+                                bits |= reach[component[t]]
+                    reach.append(bits)
+    results: Dict[State, Set[State]] = {}
+    for source, root in roots.items():
+        bits = bin(reach[component[root]])[:1:-1]
+        results[source] = set()
+        n = bits.find("1")
+        while n >= 0:
+            results[source].add(sink_list[n])
+            n = bits.find("1", n + 1)
+    return results
+
+
+@profiled
 def MatchBoth(nfa1: NFA, nfa2: NFA, start_from: Optional[Set[State]] = None, stop_at: Optional[Set[State]] = None) -> NFA:
     """Handles: A&B"""
-    # generate transitions on cartesian product (with special handling for *-transitions)
+    # generate transitions on the cartesian product (with special handling for *-transitions),
+    # exploring only those pairs of states that are reachable from the start
     # warning: some of the other methods currently depend on the implementation of this (which is naughty)
     transitions: Transitions = {}
     captures: Captures = {}
-    for (s1, i), ts1 in nfa1.transitions.items():
-        for s2 in nfa2.states:
-            if i == Move.EMPTY:
-                transitions = merge_trans(transitions, {((s1, s2), i): set(product(ts1, {s2}))})
-            else:
-                ts2 = nfa2.transitions.get((s2, i), nfa2.transitions.get((s2, Move.ALL)))
-                if ts2 is not None:
-                    transitions = merge_trans(transitions, {((s1, s2), i): set(product(ts1, ts2))})
-                    cs2 = nfa1.captures.get((s1, i), set()) | nfa2.captures.get((s2, i), nfa2.captures.get((s2, Move.ALL), set()))
-                    if cs2:
-                        captures = merge_trans(captures, {((s1, s2), i): cs2})
-    for (s2, i), ts2 in nfa2.transitions.items():
-        for s1 in nfa1.states:
-            if i == Move.EMPTY:
-                transitions = merge_trans(transitions, {((s1, s2), i): set(product({s1}, ts2))})
-            elif (s1, i) not in nfa1.transitions:  # (as we've done those already!)
-                ts1o = nfa1.transitions.get((s1, Move.ALL))
-                if ts1o is not None:
-                    transitions = merge_trans(transitions, {((s1, s2), i): set(product(ts1o, ts2))})
-                    cs1o = nfa2.captures.get((s2, i), set()) | nfa1.captures.get((s1, Move.ALL), set())
-                    if cs1o:
-                        captures = merge_trans(captures, {((s1, s2), i): cs1o})
+    to_process = list(start_from) if start_from else [(nfa1.start, nfa2.start)]
+    processed = set(to_process)
+    while to_process:
+        state = to_process.pop()
+        moves, move_captures = product_moves(nfa1, nfa2, *state)
+        for i, cs in move_captures.items():
+            captures[(state, i)] = cs
+        for i, ts in moves.items():
+            transitions[(state, i)] = ts
+            for t in ts:
+                if t not in processed:
+                    processed.add(t)
+                    to_process.append(t)
     if start_from:
-        transitions[("1", Move.EMPTY)] = start_from
+        transitions[("1", Move.EMPTY)] = set(start_from)
     if stop_at:
-        transitions = merge_trans(transitions, {(s, Move.EMPTY): {"2"} for s in stop_at})
+        for s in processed & stop_at:
+            transitions.setdefault((s, Move.EMPTY), set()).add("2")
     nfa = NFA("1" if start_from else (nfa1.start, nfa2.start), "2" if stop_at else (nfa1.end, nfa2.end), transitions, captures)
     nfa.remove_redundant_states()
     return nfa
 
 
+@profiled
 def MatchContains(nfa1: NFA, nfa2: NFA, proper: bool) -> NFA:
     """Handles: A<B, A<<B, A>B, A>>B"""
     # transition from (2) A to (3) AxB to (5) A states
@@ -628,6 +2227,7 @@ def MatchContains(nfa1: NFA, nfa2: NFA, proper: bool) -> NFA:
     return nfa
 
 
+@profiled
 def MatchInterleaved(nfa1: NFA, nfa2: NFA, proper: bool) -> NFA:
     """Handles: A^B, A^^B"""
     # transition between (2) AxB and (3) AxB states
@@ -655,6 +2255,7 @@ def MatchInterleaved(nfa1: NFA, nfa2: NFA, proper: bool) -> NFA:
     return nfa
 
 
+@profiled
 def MatchAlternating(nfa1: NFA, nfa2: NFA, ordered: bool) -> NFA:
     """Handles: A#B, A##B"""
     # transition between (1) AxB and (2) AxB states
@@ -676,6 +2277,7 @@ def MatchAlternating(nfa1: NFA, nfa2: NFA, ordered: bool) -> NFA:
     return nfa
 
 
+@profiled
 def MatchSubtract(nfa1: NFA, nfa2: NFA, from_right: bool, negate: bool) -> NFA:
     """Handles: A-B, A_-B (and used in slicing)"""
     # rewire end/start state of nfa1 based on partial intersection with nfa2
@@ -693,13 +2295,14 @@ def MatchSubtract(nfa1: NFA, nfa2: NFA, from_right: bool, negate: bool) -> NFA:
         transitions = merge_trans(transitions, {(Middle(s), Move.EMPTY): {End()} for s in midpoints})
         nfa = NFA(Middle(nfa1.start), End(), transitions, captures)
     else:
-        midpoints = {a for ((a, b), i), cs in both.transitions.items() if i == Move.EMPTY and both.end in cs}
+        midpoints = {a for a, b in both.sources(both.end, Move.EMPTY)}
         transitions[(Start(), Move.EMPTY)] = {Middle(s) for s in midpoints}
         nfa = NFA(Start(), Middle(nfa1.end), transitions, captures)
     nfa.remove_redundant_states()
     return nfa
 
 
+@profiled
 def MatchSubtractInside(nfa1: NFA, nfa2: NFA, proper: bool, replace: Optional[NFA] = None) -> NFA:
     """Handles: A->B, A->>B"""
     # like MatchContains, but link (2) and (4)/(5) using partial intersection
@@ -711,50 +2314,40 @@ def MatchSubtractInside(nfa1: NFA, nfa2: NFA, proper: bool, replace: Optional[NF
         c1 = {(LeftFirst(s), i): cs for (s, i), cs in nfa1.captures.items()}
     t2 = {(Left(s), i): {Left(t) for t in ts} for (s, i), ts in nfa1.transitions.items()}
     c2 = {(Left(s), i): cs for (s, i), cs in nfa1.captures.items()}
-    t2es = []
     if replace:
         t3 = {(Replace(s, q), i): {Replace(s, t) for t in ts} for (q, i), ts in replace.transitions.items() for s in nfa1.states}
         c3 = {(Replace(s, q), i): cs for (q, i), cs in replace.captures.items() for s in nfa1.states}
         t3e = {(Replace(s, replace.end), Move.EMPTY): {(RightFirst(s) if proper else Right(s))} for s in nfa1.states}
-    for s in nfa1.states:
-        both = MatchBoth(nfa1, nfa2, start_from={(s, nfa2.start)}, stop_at={(a, nfa2.end) for a in nfa1.states})
-        new_end = {a for a, _ in both.transitions.get((both.start, Move.EMPTY), set())}
-        new_start = {a[0] for (a, i), cs in both.transitions.items() if i == Move.EMPTY and both.end in cs}
-        t2es.append(
-            {(Left(e), Move.EMPTY): {(Replace(s, replace.start) if replace else RightFirst(s) if proper else Right(s)) for s in new_start} for e in new_end}
-        )
+    reachable = product_reachability(nfa1, nfa2, {(s, nfa2.start) for s in nfa1.states}, {(s, nfa2.end) for s in nfa1.states})
+    t2e = {
+        (Left(e), Move.EMPTY): {(Replace(s, replace.start) if replace else RightFirst(s) if proper else Right(s)) for s, _ in ends}
+        for (e, _), ends in reachable.items()
+        if ends
+    }
     if proper:
         t4 = {(RightFirst(s), i): {RightFirst(t) for t in ts} for (s, i), ts in nfa1.transitions.items() if i == Move.EMPTY}
         t4e = {(RightFirst(s), i): {Right(t) for t in ts} for (s, i), ts in nfa1.transitions.items() if i != Move.EMPTY}
         c4 = {(RightFirst(s), i): cs for (s, i), cs in nfa1.captures.items()}
     t5 = {(Right(s), i): {Right(t) for t in ts} for (s, i), ts in nfa1.transitions.items()}
     c5 = {(Right(s), i): cs for (s, i), cs in nfa1.captures.items()}
-    transitions = merge_trans(t1, t1e, t2, *t2es, t3, t3e, t4, t4e, t5)
+    transitions = merge_trans(t1, t1e, t2, t2e, t3, t3e, t4, t4e, t5)
     captures = merge_trans(c1, c2, c3, c4, c5)
     nfa = NFA(LeftFirst(nfa1.start) if proper else Left(nfa1.start), Right(nfa1.end), transitions, captures)
     nfa.remove_redundant_states()
     return nfa
 
 
+@profiled
 def MatchSubtractOutside(nfa1: NFA, nfa2: NFA, proper: bool) -> NFA:
     """Handles: A-<B, A-<<B"""
-    # Use partial intersections to generate collections of alternatives.
-    both_start = MatchBoth(nfa1, nfa2, stop_at={(a, b) for a in nfa1.states for b in nfa2.states})
-    both_end = MatchBoth(nfa1, nfa2, start_from={(a, b) for a in nfa1.states for b in nfa2.states})
-    both_start_end = {s for (s, i), cs in both_start.transitions.items() if i == Move.EMPTY and both_start.end in cs}
-    both_end_start = both_end.transitions.get((both_end.start, Move.EMPTY), set())
-
-    if proper:
-        # ensure partial intersections are (potentially) non-empty
-        both_start_proper = MatchBoth(both_start, MatchLength(1))
-        both_start_end = {
-            s[0] for (s, i), cs in both_start_proper.transitions.items() if i == Move.EMPTY and both_start_proper.end in cs and s[0] != both_start.end
-        }
-        both_end_proper = MatchBoth(both_end, MatchLength(1))
-        both_end_start = {s[0] for s in both_end_proper.transitions.get((both_end_proper.start, Move.EMPTY), set()) if s[0] != both_end.start}
+    # Use partial intersections to generate collections of alternatives
+    # (for proper subtraction, ensure the partial intersections are non-empty)
+    both_start_end = product_reachable(nfa1, nfa2, (nfa1.start, nfa2.start), proper)
+    sources = {(a, b) for a in nfa1.states for b in {b for _, b in both_start_end}}
+    both_end_start = {s for s, ends in product_reachability(nfa1, nfa2, sources, {(nfa1.end, nfa2.end)}, proper).items() if ends}
 
     nfas: List[NFA] = []
-    midpoints = {b for a, b in both_start_end if any(b == b2 for a2, b2 in both_end_start)}
+    midpoints = {b for _, b in both_start_end} & {b for _, b in both_end_start}
     for m in midpoints:
         Start, Middle, End = new_states("-<a", "-<m", "-<z")
         transitions: Transitions = {(Middle(s), i): {Middle(t) for t in ts} for (s, i), ts in nfa1.transitions.items()}
@@ -768,6 +2361,7 @@ def MatchSubtractOutside(nfa1: NFA, nfa2: NFA, proper: bool) -> NFA:
     return MatchEither(*nfas)
 
 
+@profiled
 def MatchSubtractAlternating(nfa1: NFA, nfa2: NFA, ordered: bool, from_right: bool = True) -> NFA:
     """Handles: A-#B, A_-#B, A-##B"""
     # Expand transitions in A with one from A&B (tracking both A and B states)
@@ -780,7 +2374,7 @@ def MatchSubtractAlternating(nfa1: NFA, nfa2: NFA, ordered: bool, from_right: bo
                 states = {(t, b) for t in ts}
             else:
                 ts = nfa1.expand_epsilons(ts)
-                states = {u for (r, i), us in both.transitions.items() for t in ts if r == (t, b) and i != Move.EMPTY for u in us}
+                states = {u for t in ts for i, us in both.outgoing.get((t, b), {}).items() if i != Move.EMPTY for u in us}
             transitions[((s, b), i)] = states
             if (s, i) in nfa1.captures:
                 captures[((s, b), i)] = nfa1.captures[(s, i)]
@@ -794,7 +2388,7 @@ def MatchSubtractAlternating(nfa1: NFA, nfa2: NFA, ordered: bool, from_right: bo
     if not ordered or not from_right:
         ts = {(nfa1.start, nfa2.start)}
         ts = both.expand_epsilons(ts)
-        start_state |= {u for (s, i), us in both.transitions.items() if s in ts and i != Move.EMPTY for u in us}
+        start_state |= {u for s in ts for i, us in both.outgoing.get(s, {}).items() if i != Move.EMPTY for u in us}
     if not ordered or from_right:
         start_state |= {(nfa1.start, nfa2.start)}
     if len(start_state) == 1:
@@ -806,6 +2400,7 @@ def MatchSubtractAlternating(nfa1: NFA, nfa2: NFA, ordered: bool, from_right: bo
     return nfa
 
 
+@profiled
 def MatchSubtractInterleaved(nfa1: NFA, nfa2: NFA, proper: bool, from_right: bool = True) -> NFA:
     """Handles: A-^B, A-^^B, A_-^^B"""
     # Combine transitions from A with empty transitions from A&B (tracking both A and B states)
@@ -839,12 +2434,12 @@ def MatchSubtractInterleaved(nfa1: NFA, nfa2: NFA, proper: bool, from_right: boo
         nfa = NFA(First(nfa1.start), Last(nfa1.end), transitions, captures)
     else:
         ts = both.expand_epsilons({(nfa1.start, nfa2.start)})
-        start_states = {u for (s, i), us in both.transitions.items() if s in ts and i != Move.EMPTY for u in us}
-        ts = set()
-        for t in both.states:
-            if (nfa1.end, nfa2.end) in both.expand_epsilons({t}):
-                ts.add(t)
-        end_states = {s for (s, i), us in both.transitions.items() if any(u in ts for u in us) and i != Move.EMPTY}
+        start_states = {u for s in ts for i, us in both.outgoing.get(s, {}).items() if i != Move.EMPTY for u in us}
+        ts, new = set(), {(nfa1.end, nfa2.end)}
+        while new:
+            ts.update(new)
+            new = {s for t in new for s in both.sources(t, Move.EMPTY) if s not in ts}
+        end_states = {s for u in ts for s, i in both.incoming.get(u, ()) if i != Move.EMPTY}
 
         transitions[("a", Move.EMPTY)] = start_states
         for s in end_states:
@@ -854,6 +2449,7 @@ def MatchSubtractInterleaved(nfa1: NFA, nfa2: NFA, proper: bool, from_right: boo
     return nfa
 
 
+@profiled
 def MatchReversed(nfa: NFA) -> NFA:
     """Handles: (?r:A)"""
     # just reverse the edges (with special handling for *-transitions)
@@ -863,12 +2459,12 @@ def MatchReversed(nfa: NFA) -> NFA:
     for (s, i), ts in nfa.transitions.items():
         for t in ts:
             if i == Move.ALL:
-                if any(r != s and t in vs for (r, j), vs in nfa.transitions.items()):
+                if any(r != s for r, _ in nfa.incoming.get(t, ())):
                     extra_state = Extra(s, t)
                     transitions.setdefault((t, Move.EMPTY), set()).add(extra_state)
                     t = extra_state
-                for (r, j), _ in nfa.transitions.items():
-                    if r == s and not isinstance(j, Move):
+                for j in nfa.outgoing[s]:
+                    if not isinstance(j, Move):
                         transitions.setdefault((t, j), set())
             transitions.setdefault((t, i), set()).add(s)
             if (s, i) in nfa.captures:
@@ -878,6 +2474,7 @@ def MatchReversed(nfa: NFA) -> NFA:
     return nfa
 
 
+@profiled
 def MatchInsensitively(nfa: NFA) -> NFA:
     """Handles: (?i:A)"""
     transitions: Transitions = {}
@@ -894,25 +2491,38 @@ def MatchInsensitively(nfa: NFA) -> NFA:
     return NFA(nfa.start, nfa.end, transitions, captures)
 
 
+def shift_string(text: str, shift: int) -> str:
+    """Cipher-shift the ASCII letters in a string."""
+    shifted = []
+    for c in text:
+        for alphabet in (string.ascii_lowercase, string.ascii_uppercase):
+            if c in alphabet:
+                c = alphabet[(alphabet.index(c) + shift) % 26]
+                break
+        shifted.append(c)
+    return "".join(shifted)
+
+
+@profiled
 def MatchShifted(nfa: NFA, shift: int) -> NFA:
     """Handles: (?sn:A)"""
     transitions: Transitions = {}
     captures: Captures = {}
     for (s, i), ts in nfa.transitions.items():
         c = nfa.captures.get((s, i), None)
-        for alphabet in (string.ascii_lowercase, string.ascii_uppercase):
-            if isinstance(i, str) and i in alphabet:
-                i = alphabet[(alphabet.index(i) + shift) % 26]
-                break
+        if isinstance(i, str):
+            i = shift_string(i, shift)
         transitions[(s, i)] = ts
         if c is not None:
             captures[(s, i)] = c
     return NFA(nfa.start, nfa.end, transitions, captures)
 
 
+@profiled
 def MatchRotated(nfa: NFA, shift: int) -> NFA:
     """Handles (?Rn:A)"""
     # slice off start/end and for each possibility move it to the other side
+    # (the partial intersection with the window is calculated once, and trimmed for each midpoint)
     if shift == 0:
         return nfa
 
@@ -920,10 +2530,10 @@ def MatchRotated(nfa: NFA, shift: int) -> NFA:
     if shift < 0:
         window = MatchLength(-shift, -shift)
         intersection = MatchBoth(nfa, window, stop_at={(a, window.end) for a in nfa.states})
-        intersection_ends = {s[0] for (s, i), cs in intersection.transitions.items() if i == Move.EMPTY and intersection.end in cs and s[0] != nfa.end}
+        intersection_ends = {s[0] for s in intersection.sources(intersection.end, Move.EMPTY) if s[0] != nfa.end}
         for middle in intersection_ends:
-            move = MatchBoth(nfa, window, stop_at={(middle, window.end)})
-            keep = NFA(middle, nfa.end, nfa.transitions, nfa.captures)
+            move = intersection.trimmed(end=(middle, window.end))
+            keep = nfa.trimmed(start=middle)
             rotated = MatchAfter(keep, move)
             rotated.remove_redundant_states()
             rotations.append(rotated)
@@ -932,8 +2542,8 @@ def MatchRotated(nfa: NFA, shift: int) -> NFA:
         intersection = MatchBoth(nfa, window, start_from={(a, window.start) for a in nfa.states})
         intersection_starts = {s[0] for s in intersection.transitions.get((intersection.start, Move.EMPTY), set()) if s[0] != nfa.start}
         for middle in intersection_starts:
-            move = MatchBoth(nfa, window, start_from={(middle, window.start)})
-            keep = NFA(nfa.start, middle, nfa.transitions, nfa.captures)
+            move = intersection.trimmed(start=(middle, window.start))
+            keep = nfa.trimmed(end=middle)
             rotated = MatchAfter(move, keep)
             rotated.remove_redundant_states()
             rotations.append(rotated)
@@ -943,6 +2553,7 @@ def MatchRotated(nfa: NFA, shift: int) -> NFA:
     return rotation
 
 
+@profiled
 def MatchSlice(nfa: NFA, start: Optional[int], end: Optional[int], step: int) -> NFA:
     """Handles: (?S:A)[3:5], (?S:A)[-1::-2]"""
     # reverse slice is equivalent to slice of reverse
@@ -972,7 +2583,7 @@ def MatchSlice(nfa: NFA, start: Optional[int], end: Optional[int], step: int) ->
             for _ in range(n):
                 states = nfa.expand_epsilons(states)
                 hit_end |= nfa.end in states
-                states = {t for s in states for (r, i), ts in nfa.transitions.items() if r == s and i != Move.EMPTY for t in ts}
+                states = {t for s in states for i, ts in nfa.outgoing.get(s, {}).items() if i != Move.EMPTY for t in ts}
             return states, hit_end
 
         transitions: Transitions = {}
@@ -993,6 +2604,165 @@ def MatchSlice(nfa: NFA, start: Optional[int], end: Optional[int], step: int) ->
 
 
 # Patterns
+def MatchDictionaryFSM() -> NFA:
+    r"""Handles: \w"""
+    return DICTIONARY_FSM
+
+
+def MatchExplicitFSM() -> NFA:
+    r"""Handles: \f"""
+    return EXPLICIT_FSM
+
+
+# Pattern ASTs
+
+
+class PatternAST:
+    """Parsed pattern expression: an NFA constructor and its arguments (which may themselves be PatternASTs).
+    MatchAfter and MatchBoth nodes may have more than two operands."""
+
+    VARIADIC = ("MatchAfter", "MatchBoth", "MatchEither")
+    PRODUCTS = ("MatchBoth", "MatchContains", "MatchInterleaved", "MatchAlternating", "MatchSubtractAlternating", "MatchSubtractInterleaved")
+
+    def __init__(self, constructor: Callable[..., NFA], *args: Any):
+        self.constructor = constructor
+        self.args = args
+        self._hash = hash((constructor, args))
+
+    @property
+    def name(self) -> str:
+        return self.constructor.__name__
+
+    def __repr__(self) -> str:
+        return f"{self.name}({', '.join(map(repr, self.args))})"
+
+    def __eq__(self, other):
+        return isinstance(other, PatternAST) and self._hash == other._hash and self.constructor == other.constructor and self.args == other.args
+
+    def __hash__(self):
+        return self._hash
+
+    @property
+    def children(self) -> List["PatternAST"]:
+        return [a for a in self.args if isinstance(a, PatternAST)]
+
+    def build(self, built: Optional[Dict["PatternAST", NFA]] = None) -> NFA:
+        """Construct the NFA, building any repeated subexpressions just once."""
+        built = {} if built is None else built
+        if self not in built:
+            args = [a.build(built) if isinstance(a, PatternAST) else a for a in self.args]
+            if self.name in ("MatchAfter", "MatchBoth"):
+                built[self] = reduce(self.constructor, args)
+            else:
+                built[self] = self.constructor(*args)
+        return built[self]
+
+    def estimate(self) -> int:
+        """A rough estimate of the constructed NFA's size, used for ordering operands."""
+        if self.constructor is MatchDictionaryFSM:
+            return len(DICTIONARY_FSM.states) if DICTIONARY_FSM is not None else 2
+        elif self.constructor is MatchExplicitFSM:
+            return len(EXPLICIT_FSM.states) if EXPLICIT_FSM is not None else 2
+        elif self.constructor is MatchWords:
+            return sum(len(w) for w in self.args[0]) + 2
+        elif self.constructor is MatchRepeatedN:
+            return self.args[0].estimate() * max(1, self.args[2])
+        elif self.constructor is MatchRepeatedNplus:
+            return self.args[0].estimate() * max(1, self.args[1])
+        elif self.name in self.PRODUCTS:
+            return math.prod(c.estimate() for c in self.children)
+        return sum(c.estimate() for c in self.children) + 2
+
+    def words(self) -> Optional[FrozenSet[str]]:
+        """The strings matched by the expression, if it's a small, capture-free combination of literals."""
+        if self.constructor is MatchIn:
+            return frozenset(self.args[0])
+        elif self.constructor is MatchEmpty:
+            return frozenset({""})
+        elif self.constructor is MatchWords:
+            return frozenset(self.args[0])
+        elif self.constructor is MatchShifted:
+            words = self.args[0].words()
+            return None if words is None else frozenset(shift_string(w, self.args[1]) for w in words)
+        elif self.constructor in (MatchAfter, MatchEither):
+            words = frozenset({""}) if self.constructor is MatchAfter else frozenset()
+            for child in self.children:
+                child_words = child.words()
+                if child_words is None:
+                    return None
+                words = frozenset(a + b for a in words for b in child_words) if self.constructor is MatchAfter else words | child_words
+                if len(words) > MAX_FOLDED_WORDS:
+                    return None
+            return words
+        return None
+
+    def optimise(self) -> "PatternAST":
+        """Rewrite the expression into a (hopefully) cheaper equivalent one."""
+        return PatternAST(self.constructor, *(a.optimise() if isinstance(a, PatternAST) else a for a in self.args)).rewrite()
+
+    def rewrite(self) -> "PatternAST":
+        """Apply local rewrite rules, assuming the operands are already optimised."""
+        if self.name in self.VARIADIC:
+            # flatten nested operations and remove duplicates
+            args: List[PatternAST] = []
+            for arg in self.args:
+                args.extend(arg.args if arg.constructor is self.constructor else [arg])
+            if self.constructor is MatchAfter:
+                args = [a for a in args if a.constructor is not MatchEmpty]
+            else:
+                args = list(dict.fromkeys(args))
+            # merge character classes
+            if self.constructor is not MatchAfter:
+                classes = [a for a in args if a.constructor in (MatchIn, MatchNotIn)]
+                if len(classes) > 1:
+                    merged = reduce(merge_char_classes if self.constructor is MatchEither else intersect_char_classes, classes)
+                    args = [merged if a is classes[0] else a for a in args if a not in classes[1:]]
+            # fold alternatives between literals into a minimal acyclic automaton
+            if self.constructor is MatchEither and len(args) > 1:
+                words = PatternAST(MatchEither, *args).words()
+                if words is not None and "" not in words:
+                    return PatternAST(MatchWords, tuple(sorted(words)))
+            # intersect smaller operands first
+            if self.constructor is MatchBoth:
+                args.sort(key=lambda a: a.estimate())
+            if not args:
+                return PatternAST(MatchEmpty)
+            return args[0] if len(args) == 1 else PatternAST(self.constructor, *args)
+        elif self.constructor is MatchRepeatedN:
+            nfa, minimum, maximum = self.args
+            if minimum == maximum == 0:
+                return PatternAST(MatchEmpty)
+            elif minimum == maximum == 1:
+                return nfa
+            elif minimum == maximum and nfa.constructor is MatchRepeatedN and nfa.args[1] == nfa.args[2]:
+                return PatternAST(MatchRepeatedN, nfa.args[0], minimum * nfa.args[1], maximum * nfa.args[2]).rewrite()
+        elif self.constructor is MatchReversed and self.args[0].constructor is MatchReversed:
+            return self.args[0].args[0]
+        elif self.constructor is MatchInsensitively and self.args[0].constructor is MatchInsensitively:
+            return self.args[0]
+        return self
+
+
+def merge_char_classes(a: PatternAST, b: PatternAST) -> PatternAST:
+    """Union of two MatchIn/MatchNotIn character classes."""
+    if a.constructor is MatchIn and b.constructor is MatchIn:
+        return PatternAST(MatchIn, "".join(sorted(set(a.args[0]) | set(b.args[0]))))
+    elif a.constructor is MatchNotIn and b.constructor is MatchNotIn:
+        return PatternAST(MatchNotIn, "".join(sorted(set(a.args[0]) & set(b.args[0]))))
+    included, excluded = (a, b) if a.constructor is MatchIn else (b, a)
+    return PatternAST(MatchNotIn, "".join(sorted(set(excluded.args[0]) - set(included.args[0]))))
+
+
+def intersect_char_classes(a: PatternAST, b: PatternAST) -> PatternAST:
+    """Intersection of two MatchIn/MatchNotIn character classes."""
+    if a.constructor is MatchIn and b.constructor is MatchIn:
+        return PatternAST(MatchIn, "".join(sorted(set(a.args[0]) & set(b.args[0]))))
+    elif a.constructor is MatchNotIn and b.constructor is MatchNotIn:
+        return PatternAST(MatchNotIn, "".join(sorted(set(a.args[0]) | set(b.args[0]))))
+    included, excluded = (a, b) if a.constructor is MatchIn else (b, a)
+    return PatternAST(MatchIn, "".join(sorted(set(included.args[0]) - set(excluded.args[0]))))
+
+
 def op_reduce(l):
     if len(l) == 1:
         return l[0]
@@ -1003,121 +2773,277 @@ def op_reduce(l):
 class Pattern:
     """Regex-style pattern supporting novel spatial operators and modifiers."""
 
-    def __init__(self, pattern: str):
+    def __init__(self, pattern: str, nfa: Optional[NFA] = None):
         self.pattern = pattern
-        self.nfa = self.expr.parseString(pattern, parseAll=True)[0]
+        self.ast: Optional[PatternAST] = None
+        if nfa is None:
+            self.ast = self.parse(pattern).optimise()
+            nfa = self.ast.build()
+        self.nfa = nfa
+        self._prefilter: Optional[Prefilter] = None
+        self._unfiltered = 0
+        self._counter: Optional[MatchCounter] = None
+        self._batch_matcher: Optional[BatchMatcher] = None
+        self._searcher: Optional[Searcher] = None
 
     def __repr__(self):
         return f"Pattern({self.pattern!r})"
 
+    @classmethod
+    def parse(cls, pattern: str) -> PatternAST:
+        """Parse a pattern into an unoptimised PatternAST."""
+        return cls.grammar(EXTRA_PRINTABLES).parseString(pattern, parseAll=True)[0]
+
+    @property
+    def prefilter(self) -> Prefilter:
+        """Cheap checks for rejecting non-matching strings, generated on first use."""
+        if self._prefilter is None:
+            self._prefilter = Prefilter(self.nfa)
+        return self._prefilter
+
     def match(self, string: str) -> Optional[CaptureOutput]:
+        if self._prefilter is None and self._unfiltered < len(self.nfa.states):
+            # generating prefilters costs about as much as compiling the NFA, so defer it until it's likely to pay off
+            self._unfiltered += 1
+        elif not self.prefilter(string):
+            return None
         return self.nfa.match(string)
 
+    @property
+    def batch_matcher(self) -> BatchMatcher:
+        """Vectorised matcher for batches of strings, generated on first use."""
+        if self._batch_matcher is None:
+            self._batch_matcher = BatchMatcher(self.nfa)
+        return self._batch_matcher
+
+    def match_many(self, strings: Iterable[str]) -> "np.ndarray":
+        """Boolean array indicating which strings match, calculated for whole batches of strings at once using NumPy.
+        Any non-string values are treated as non-matches."""
+        return self.batch_matcher.match(strings if isinstance(strings, (list, tuple, np.ndarray)) else list(strings))
+
+    def mask(self, series: "pd.Series", captures: bool = False) -> Union["pd.Series", "pd.DataFrame"]:
+        """Boolean mask indicating which values in a pandas Series match (e.g. for filtering a DataFrame column).
+        If captures is set, then also return a column for each capture group, in a DataFrame. Null values (None, NaN, etc)
+        never match, while other non-string values are matched using their string representation."""
+        present = series.notna().to_numpy()
+        values = [v if isinstance(v, str) else str(v) for v in series.to_numpy(dtype=object)[present]]
+        mask = np.zeros(len(series), dtype=bool)
+        mask[present] = self.match_many(values)
+        if not captures:
+            return pd.Series(mask, index=series.index, name=series.name)
+        strings = np.full(len(series), None, dtype=object)
+        strings[present] = values
+        matches = [(self.nfa.match_captures(s) or {}) if m else {} for s, m in zip(strings, mask)]
+        groups = sorted({g for cs in self.nfa.captures.values() for g in cs})
+        return pd.DataFrame({"match": mask, **{g: [m.get(g) for m in matches] for g in groups}}, index=series.index)
+
+    @property
+    def searcher(self) -> Searcher:
+        """Substring searcher, generated on first use."""
+        if self._searcher is None:
+            self._searcher = Searcher(self.nfa)
+        return self._searcher
+
+    def search(self, text: str, overlapping: bool = False) -> Iterator[Tuple[int, int]]:
+        """The (start, end) offsets of the non-empty substrings of a text that match (see Searcher.search)."""
+        return self.searcher.search(text, overlapping)
+
     def example(self, min_length: int = 0, max_length: Optional[int] = None) -> str:
         return self.nfa.example(min_length, max_length)
 
-    # parsing (should really go via an AST here)
-    from pyparsing import Forward, Group, Literal, OneOrMore
-    from pyparsing import Optional as Option
-    from pyparsing import ParserElement, Word, alphanums, alphas, infixNotation, nums, oneOf, opAssoc
-
-    ParserElement.setDefaultWhitespaceChars("")
-    ParserElement.enablePackrat()
-
-    # TODO: character escaping, supported scripts
-    _0_to_99 = Word(nums, min=1, max=2).setParseAction(lambda t: int("".join(t[0])))
-    _m99_to_99 = (Option("-") + _0_to_99).setParseAction(lambda t: t[-1] * (-1 if len(t) == 2 else 1))
-    _id = Word(alphas + "_", alphanums + "_")
+    @property
+    def counter(self) -> MatchCounter:
+        """Counter for the pattern's matches, generated on first use."""
+        if self._counter is None:
+            self._counter = MatchCounter(self.nfa)
+        return self._counter
+
+    def lengths(self, min_length: int = 0, max_length: Optional[int] = None) -> Iterable[int]:
+        """The possible match lengths within the given bounds (which may be unbounded)."""
+        nfa_min_length = self.nfa.min_length()
+        if nfa_min_length is None:
+            return range(0)
+        nfa_max_length = self.nfa.max_length()
+        if nfa_max_length is not None:
+            max_length = nfa_max_length if max_length is None else min(max_length, nfa_max_length)
+        return count(max(min_length, nfa_min_length)) if max_length is None else range(max(min_length, nfa_min_length), max_length + 1)
+
+    def count(self, min_length: int = 0, max_length: Optional[int] = None) -> int:
+        """The number of matches within the given length bounds (over a finite alphabet for wildcards)."""
+        lengths = self.lengths(min_length, max_length)
+        if not isinstance(lengths, range):
+            raise ValueError(f"Pattern {self.pattern!r} has infinitely many matches: please specify a maximum length")
+        return sum(self.counter.count(n) for n in lengths)
+
+    def sample(self, min_length: int = 0, max_length: Optional[int] = None) -> Optional[str]:
+        """A uniformly random match within the given length bounds. Unbounded matches are limited to EXAMPLE_LENGTH_RANGE characters
+        more than the minimum length."""
+        lengths = self.lengths(min_length, max_length)
+        if not isinstance(lengths, range):
+            shortest = next(iter(lengths))
+            lengths = range(shortest, shortest + EXAMPLE_LENGTH_RANGE + 1)
+        counts = [self.counter.count(n) for n in lengths]
+        if not any(counts):
+            return None
+        return self.counter.sample(random.choices(lengths, counts)[0])
+
+    def matches(self, min_length: int = 0, max_length: Optional[int] = None, offset: int = 0) -> Iterator[str]:
+        """The matches within the given length bounds, ordered by length and then lexicographically, skipping the first offset ones."""
+        for n in self.lengths(min_length, max_length):
+            total = self.counter.count(n)
+            if offset >= total:
+                offset -= total
+                continue
+            yield from self.counter.enumerate(n, offset)
+            offset = 0
 
-    printables = ppu.Latin1.printables + " " + EXTRA_PRINTABLES
+    # parsing (into a PatternAST)
     literal_exclude = r"()+*.?<>#{}^_&|$\[]-"
     set_exclude = r"\]"
 
-    literal = Word(printables, excludeChars=literal_exclude, exact=1).setParseAction(lambda t: MatchIn(t[0]))
-    dot = Literal(".").setParseAction(lambda t: MatchNotIn(""))
-    nset = ("[^" + Word(printables, excludeChars=set_exclude, min=1) + "]").setParseAction(lambda t: MatchNotIn(srange(f"[{t[1]}]")))
-    set = ("[" + Word(printables, excludeChars=set_exclude, min=1) + "]").setParseAction(lambda t: MatchIn(srange(f"[{t[1]}]")))
-    words = Literal(r"\w").setParseAction(lambda t: DICTIONARY_FSM)
-    fsm = Literal(r"\f").setParseAction(lambda t: EXPLICIT_FSM)
-
-    expr = Forward()
-    group = (
-        ("(" + expr + ")").setParseAction(lambda t: t[1])
-        | ("(?D:" + expr + ")").setParseAction(lambda t: MatchDFA(t[1], negate=False))
-        | ("(?M:" + expr + ")").setParseAction(lambda t: MatchDFA(MatchReversed(MatchDFA(MatchReversed(t[1]), negate=False)), negate=False))
-        | ("(?i:" + expr + ")").setParseAction(lambda t: MatchInsensitively(t[1]))
-        | ("(?r:" + expr + ")").setParseAction(lambda t: MatchReversed(t[1]))
-        | ("(?<" + _id + ">" + expr + ")").setParseAction(lambda t: MatchCapture(t[3], t[1]))
-        | ("(?s" + _m99_to_99 + ":" + expr + ")").setParseAction(lambda t: MatchShifted(t[3], t[1]))
-        | ("(?s:" + expr + ")").setParseAction(lambda t: MatchEither(*[MatchShifted(t[1], i) for i in range(1, 26)]))
-        | ("(?R" + _m99_to_99 + ":" + expr + ")").setParseAction(lambda t: MatchRotated(t[3], t[1]))
-        | ("(?R<=" + _0_to_99 + ":" + expr + ")").setParseAction(lambda t: MatchEither(*[MatchRotated(t[3], i) for i in range(-t[1], t[1] + 1) if i != 0]))
-        | ("(?S:" + expr + ")[" + Option(_m99_to_99, None) + ":" + Option(_m99_to_99, None) + Option(":" + Option(_m99_to_99, 1), 1) + "]").setParseAction(
-            lambda t: MatchSlice(t[1], t[3], t[5], t[-2])
-        )
-        | ("(?/" + expr + "/" + expr + "/" + expr + "/" + Option("s") + ")").setParseAction(
-            lambda t: MatchSubtractInside(t[1], t[3], proper=(t[7] == "s"), replace=t[5])
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def grammar(extra_printables: str) -> "ParserElement":
+        """The pattern grammar, built on first use (and cached for each value of EXTRA_PRINTABLES)."""
+        from pyparsing import Forward, Literal, OneOrMore
+        from pyparsing import Optional as Option
+        from pyparsing import ParserElement, Word, alphanums, alphas, infixNotation, nums, opAssoc, srange
+        from pyparsing import pyparsing_unicode as ppu
+
+        ParserElement.setDefaultWhitespaceChars("")
+        ParserElement.enablePackrat()
+
+        # TODO: character escaping, supported scripts
+        _0_to_99 = Word(nums, min=1, max=2).setParseAction(lambda t: int("".join(t[0])))
+        _m99_to_99 = (Option("-") + _0_to_99).setParseAction(lambda t: t[-1] * (-1 if len(t) == 2 else 1))
+        _id = Word(alphas + "_", alphanums + "_")
+
+        printables = ppu.Latin1.printables + " " + extra_printables
+        literal_exclude, set_exclude = Pattern.literal_exclude, Pattern.set_exclude
+
+        def chars(t: Any) -> str:
+            return "".join(sorted(set(srange(f"[{t[1]}]"))))
+
+        literal = Word(printables, excludeChars=literal_exclude, exact=1).setParseAction(lambda t: PatternAST(MatchIn, t[0]))
+        dot = Literal(".").setParseAction(lambda t: PatternAST(MatchNotIn, ""))
+        nset = ("[^" + Word(printables, excludeChars=set_exclude, min=1) + "]").setParseAction(lambda t: PatternAST(MatchNotIn, chars(t)))
+        charset = ("[" + Word(printables, excludeChars=set_exclude, min=1) + "]").setParseAction(lambda t: PatternAST(MatchIn, chars(t)))
+        words = Literal(r"\w").setParseAction(lambda t: PatternAST(MatchDictionaryFSM))
+        fsm = Literal(r"\f").setParseAction(lambda t: PatternAST(MatchExplicitFSM))
+
+        expr = Forward()
+        group = (
+            ("(" + expr + ")").setParseAction(lambda t: t[1])
+            | ("(?D:" + expr + ")").setParseAction(lambda t: PatternAST(MatchDFA, t[1], False))
+            | ("(?M:" + expr + ")").setParseAction(lambda t: PatternAST(MatchMinimalDFA, t[1]))
+            | ("(?i:" + expr + ")").setParseAction(lambda t: PatternAST(MatchInsensitively, t[1]))
+            | ("(?r:" + expr + ")").setParseAction(lambda t: PatternAST(MatchReversed, t[1]))
+            | ("(?<" + _id + ">" + expr + ")").setParseAction(lambda t: PatternAST(MatchCapture, t[3], t[1]))
+            | ("(?s" + _m99_to_99 + ":" + expr + ")").setParseAction(lambda t: PatternAST(MatchShifted, t[3], t[1]))
+            | ("(?s:" + expr + ")").setParseAction(lambda t: PatternAST(MatchEither, *[PatternAST(MatchShifted, t[1], i) for i in range(1, 26)]))
+            | ("(?R" + _m99_to_99 + ":" + expr + ")").setParseAction(lambda t: PatternAST(MatchRotated, t[3], t[1]))
+            | ("(?R<=" + _0_to_99 + ":" + expr + ")").setParseAction(
+                lambda t: PatternAST(MatchEither, *[PatternAST(MatchRotated, t[3], i) for i in range(-t[1], t[1] + 1) if i != 0])
+            )
+            | ("(?S:" + expr + ")[" + Option(_m99_to_99, None) + ":" + Option(_m99_to_99, None) + Option(":" + Option(_m99_to_99, 1), 1) + "]").setParseAction(
+                lambda t: PatternAST(MatchSlice, t[1], t[3], t[5], t[-2])
+            )
+            | ("(?/" + expr + "/" + expr + "/" + expr + "/" + Option("s") + ")").setParseAction(
+                lambda t: PatternAST(MatchSubtractInside, t[1], t[3], t[7] == "s", t[5])
+            )
+            | ("(?&" + _id + "=" + expr + ")").setParseAction(lambda t: SUBPATTERNS.update({t[1]: t[3]}) or PatternAST(MatchEmpty))
+            | ("(?&" + _id + ")").setParseAction(lambda t: SUBPATTERNS[t[1]])
         )
-        | ("(?&" + _id + "=" + expr + ")").setParseAction(lambda t: SUBPATTERNS.update({t[1]: t[3]}) or MatchEmpty())
-        | ("(?&" + _id + ")").setParseAction(lambda t: SUBPATTERNS[t[1]])
-    )
-    atom = literal | dot | nset | set | words | fsm | group
-    item = (
-        (atom + "+").setParseAction(
-            lambda t: MatchRepeated(
-                t[0],
-                repeat=True,
+        atom = literal | dot | nset | charset | words | fsm | group
+        item = (
+            (atom + "+").setParseAction(
+                lambda t: PatternAST(MatchRepeated, t[0], True, False)
             )
+            | (atom + "*").setParseAction(lambda t: PatternAST(MatchRepeated, t[0], True, True))
+            | (atom + "?").setParseAction(lambda t: PatternAST(MatchRepeated, t[0], False, True))
+            | (atom + "{" + _0_to_99 + "}").setParseAction(lambda t: PatternAST(MatchRepeatedN, t[0], t[2], t[2]))
+            | (atom + "{" + _0_to_99 + ",}").setParseAction(lambda t: PatternAST(MatchRepeatedNplus, t[0], t[2]))
+            | (atom + "{" + _0_to_99 + "," + _0_to_99 + "}").setParseAction(lambda t: PatternAST(MatchRepeatedN, t[0], t[2], t[4]))
+            | ("¬" + atom).setParseAction(lambda t: PatternAST(MatchDFA, t[1], True))
+            | atom
         )
-        | (atom + "*").setParseAction(lambda t: MatchRepeated(t[0], repeat=True, optional=True))
-        | (atom + "?").setParseAction(lambda t: MatchRepeated(t[0], optional=True))
-        | (atom + "{" + _0_to_99 + "}").setParseAction(lambda t: MatchRepeatedN(t[0], t[2], t[2]))
-        | (atom + "{" + _0_to_99 + ",}").setParseAction(lambda t: MatchRepeatedNplus(t[0], t[2]))
-        | (atom + "{" + _0_to_99 + "," + _0_to_99 + "}").setParseAction(lambda t: MatchRepeatedN(t[0], t[2], t[4]))
-        | ("¬" + atom).setParseAction(lambda t: MatchDFA(t[1], negate=True))
-        | atom
-    )
-    items = OneOrMore(item).setParseAction(lambda t: reduce(MatchAfter, t))
-
-    spatial_ops = (
-        # conjunction
-        Literal(">>").setParseAction(lambda _: lambda x, y: MatchContains(x, y, proper=True))
-        | Literal(">").setParseAction(lambda _: lambda x, y: MatchContains(x, y, proper=False))
-        | Literal("<<").setParseAction(lambda _: lambda x, y: MatchContains(y, x, proper=True))
-        | Literal("<").setParseAction(lambda _: lambda x, y: MatchContains(y, x, proper=False))
-        | Literal("^^").setParseAction(lambda _: lambda x, y: MatchInterleaved(x, y, proper=True))
-        | Literal("^").setParseAction(lambda _: lambda x, y: MatchInterleaved(x, y, proper=False))
-        | Literal("##").setParseAction(lambda _: lambda x, y: MatchAlternating(x, y, ordered=True))
-        | Literal("#").setParseAction(lambda _: lambda x, y: MatchAlternating(x, y, ordered=False))
-        |
-        # subtraction
-        Literal("->>").setParseAction(lambda _: lambda x, y: MatchSubtractInside(x, y, proper=True))
-        | Literal("->").setParseAction(lambda _: lambda x, y: MatchSubtractInside(x, y, proper=False))
-        | Literal("-<<").setParseAction(lambda _: lambda x, y: MatchSubtractOutside(x, y, proper=True))
-        | Literal("-<").setParseAction(lambda _: lambda x, y: MatchSubtractOutside(x, y, proper=False))
-        | Literal("-##").setParseAction(lambda _: lambda x, y: MatchSubtractAlternating(x, y, ordered=True, from_right=True))
-        | Literal("_-##").setParseAction(lambda _: lambda x, y: MatchSubtractAlternating(x, y, ordered=True, from_right=False))
-        | Literal("-#").setParseAction(lambda _: lambda x, y: MatchSubtractAlternating(x, y, ordered=False))
-        | Literal("-^^").setParseAction(lambda _: lambda x, y: MatchSubtractInterleaved(x, y, proper=True, from_right=True))
-        | Literal("_-^^").setParseAction(lambda _: lambda x, y: MatchSubtractInterleaved(x, y, proper=True, from_right=False))
-        | Literal("-^").setParseAction(lambda _: lambda x, y: MatchSubtractInterleaved(x, y, proper=False))
-        | Literal("-").setParseAction(lambda _: lambda x, y: MatchSubtract(x, y, from_right=True, negate=False))
-        | Literal("_-").setParseAction(lambda _: lambda x, y: MatchSubtract(x, y, from_right=False, negate=False))
-    )
-    expr <<= infixNotation(
-        items,
-        [
-            ("&", 2, opAssoc.LEFT, lambda t: reduce(MatchBoth, t[0][::2])),
-            (spatial_ops, 2, opAssoc.LEFT, lambda t: op_reduce(t[0])),
-            ("|", 2, opAssoc.LEFT, lambda t: MatchEither(*t[0][::2])),
-        ],
-    )
+        items = OneOrMore(item).setParseAction(lambda t: PatternAST(MatchAfter, *t))
+
+        spatial_ops = (
+            # conjunction
+            Literal(">>").setParseAction(lambda _: lambda x, y: PatternAST(MatchContains, x, y, True))
+            | Literal(">").setParseAction(lambda _: lambda x, y: PatternAST(MatchContains, x, y, False))
+            | Literal("<<").setParseAction(lambda _: lambda x, y: PatternAST(MatchContains, y, x, True))
+            | Literal("<").setParseAction(lambda _: lambda x, y: PatternAST(MatchContains, y, x, False))
+            | Literal("^^").setParseAction(lambda _: lambda x, y: PatternAST(MatchInterleaved, x, y, True))
+            | Literal("^").setParseAction(lambda _: lambda x, y: PatternAST(MatchInterleaved, x, y, False))
+            | Literal("##").setParseAction(lambda _: lambda x, y: PatternAST(MatchAlternating, x, y, True))
+            | Literal("#").setParseAction(lambda _: lambda x, y: PatternAST(MatchAlternating, x, y, False))
+            |
+            # subtraction
+            Literal("->>").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtractInside, x, y, True))
+            | Literal("->").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtractInside, x, y, False))
+            | Literal("-<<").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtractOutside, x, y, True))
+            | Literal("-<").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtractOutside, x, y, False))
+            | Literal("-##").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtractAlternating, x, y, True, True))
+            | Literal("_-##").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtractAlternating, x, y, True, False))
+            | Literal("-#").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtractAlternating, x, y, False))
+            | Literal("-^^").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtractInterleaved, x, y, True, True))
+            | Literal("_-^^").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtractInterleaved, x, y, True, False))
+            | Literal("-^").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtractInterleaved, x, y, False))
+            | Literal("-").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtract, x, y, True, False))
+            | Literal("_-").setParseAction(lambda _: lambda x, y: PatternAST(MatchSubtract, x, y, False, False))
+        )
+        expr <<= infixNotation(
+            items,
+            [
+                ("&", 2, opAssoc.LEFT, lambda t: PatternAST(MatchBoth, *t[0][::2])),
+                (spatial_ops, 2, opAssoc.LEFT, lambda t: op_reduce(t[0])),
+                ("|", 2, opAssoc.LEFT, lambda t: PatternAST(MatchEither, *t[0][::2])),
+            ],
+        )
+        return expr
 
 
 # Regex reconstructions
 
 
+class MultiPattern:
+    """Collection of patterns that are matched together in a single pass, via a tagged union of their NFAs."""
+
+    def __init__(self, patterns: Iterable[Union[str, Pattern]]):
+        self.patterns = [p if isinstance(p, Pattern) else Pattern(p) for p in patterns]
+        self.nfa = MatchEither(*(p.nfa for p in self.patterns))
+        compiled = self.nfa.compiled()
+        index = {s: n for n, s in enumerate(compiled.labels)}
+        # MatchEither labels each pattern's end state by its (1-based) position
+        tags = {index[(str(n + 1), p.nfa.end)]: n for n, p in enumerate(self.patterns) if (str(n + 1), p.nfa.end) in index}
+        self.dfa = TaggedLazyDFA(compiled, tags)
+
+    def __repr__(self):
+        return f"MultiPattern({[p.pattern for p in self.patterns]!r})"
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def match(self, string: str) -> Dict[int, CaptureOutput]:
+        """The indices of the patterns that match a string, along with any submatch captures."""
+        matches = {}
+        for n in sorted(self.dfa.match_tags(string)):
+            pattern = self.patterns[n]
+            match = pattern.nfa.match_captures(string) if pattern.nfa.captures else {}
+            if match is not None:
+                matches[n] = match
+        return matches
+
+
 class Regex(ABC):
+    """Base class for simplified basic regular expressions. Regex nodes are hash-consed: constructing a node equal to an
+    existing one returns that same object, so equality testing is just an identity check and hashes are only calculated once."""
+
+    _interned: "weakref.WeakValueDictionary[Tuple[type, Any], Regex]" = weakref.WeakValueDictionary()
+    _hash: int
+
     @abstractmethod
     def members(self) -> Any:
         """Members, used for equality testing and hashing."""
@@ -1142,19 +3068,27 @@ class Regex(ABC):
     def first_character(self, from_end: bool = False) -> "Regex":
         """A Regex describing the first (or last) matching character."""
 
+    @abstractmethod
+    def to_nfa(self) -> NFA:
+        """An NFA matching the regex."""
+
+    def interned(self) -> "Regex":
+        """The canonical node equal to this one (which is this one if it's new)."""
+        key = (type(self), self.members())
+        self._hash = hash(key)
+        return Regex._interned.setdefault(key, self)
+
     def __repr__(self):
         return f"{self.to_string()}"
 
     def __eq__(self, other):
-        if type(other) is type(self):
-            return self.members() == other.members()
-        elif isinstance(other, Regex):
-            return False
+        if isinstance(other, Regex):
+            return self is other
         else:
             return NotImplemented
 
     def __hash__(self):
-        return hash((type(self), self.members()))
+        return self._hash
 
     def __add__(self, other):
         if isinstance(other, Regex):
@@ -1180,7 +3114,7 @@ class RegexChars(Regex):
 
         obj = super().__new__(cls)
         obj.chars = "".join(sorted(set(chars)))
-        return obj
+        return obj.interned()
 
     def members(self):
         return self.chars
@@ -1200,10 +3134,18 @@ class RegexChars(Regex):
     def first_character(self, from_end: bool = False) -> Regex:
         return self
 
+    def to_nfa(self) -> NFA:
+        return MatchIn(self.chars)
+
 
 class RegexNegatedChars(Regex):
-    def __init__(self, chars):
-        self.chars = "".join(sorted(set(chars)))
+
+    chars: str
+
+    def __new__(cls, chars):
+        obj = super().__new__(cls)
+        obj.chars = "".join(sorted(set(chars)))
+        return obj.interned()
 
     def members(self):
         return self.chars
@@ -1223,6 +3165,9 @@ class RegexNegatedChars(Regex):
     def first_character(self, from_end: bool = False) -> Regex:
         return self
 
+    def to_nfa(self) -> NFA:
+        return MatchNotIn(self.chars)
+
 
 class RegexStar(Regex):
 
@@ -1267,7 +3212,7 @@ class RegexStar(Regex):
 
         obj = super().__new__(cls)
         obj.regex = regex
-        return obj
+        return obj.interned()
 
     def members(self):
         return self.regex
@@ -1287,6 +3232,9 @@ class RegexStar(Regex):
     def first_character(self, from_end: bool = False) -> Regex:
         return RegexConcat() | self.regex.first_character(from_end)
 
+    def to_nfa(self) -> NFA:
+        return MatchRepeated(regex_nfa(self.regex), repeat=True, optional=True)
+
 
 class RegexUnion(Regex):
 
@@ -1349,7 +3297,7 @@ class RegexUnion(Regex):
 
         obj = super().__new__(cls)
         obj.regexes = frozenset(regexes)
-        return obj
+        return obj.interned()
 
     def members(self):
         return self.regexes
@@ -1376,6 +3324,9 @@ class RegexUnion(Regex):
     def first_character(self, from_end: bool = False) -> Regex:
         return RegexUnion(r.first_character(from_end) for r in self.regexes)
 
+    def to_nfa(self) -> NFA:
+        return MatchEither(*(regex_nfa(r) for r in self.regexes)) if self.regexes else NFA("1", "2", {})
+
 
 class RegexConcat(Regex):
 
@@ -1427,7 +3378,7 @@ class RegexConcat(Regex):
 
         obj = super().__new__(cls)
         obj.regexes = tuple(regexes)
-        return obj
+        return obj.interned()
 
     def members(self):
         return self.regexes
@@ -1467,8 +3418,17 @@ class RegexConcat(Regex):
             fc |= RegexConcat()
         return fc
 
+    def to_nfa(self) -> NFA:
+        return reduce(MatchAfter, (regex_nfa(r) for r in self.regexes)) if self.regexes else MatchEmpty()
 
-@lru_cache(maxsize=None)
+
+@lru_cache(maxsize=REGEX_NFA_CACHE_SIZE)
+def regex_nfa(regex: Regex) -> NFA:
+    """Cached NFA for a regex (which is safe as the NFA constructors never modify their inputs)."""
+    return regex.to_nfa()
+
+
+@lru_cache(maxsize=REGEX_IMPLIES_CACHE_SIZE)
 def regex_implies(a: Regex, b: Regex) -> bool:
     """Whether one regex implies the other."""
     # A < B
@@ -1513,29 +3473,25 @@ def regex_implies(a: Regex, b: Regex) -> bool:
     # incompatible last characters
     elif not regex_implies(a.first_character(from_end=True), b.first_character(from_end=True)):
         return False
-    # the slow way using FMSs
+    # the slow way using FMSs: A < B iff A&¬B is empty
     if SLOW_SIMPLIFICATION:
-        try:
-            ans = Pattern(f"¬(¬({a})|{b})").nfa.min_length() is None
-            logger.debug("%s =%s=> %s", a, "=" if ans else "/", b)
-            return ans
-        except ParseException:
-            # currently doesn't work with e.g. emoji injected via \f or \w 🙁
-            warnings.warn("Cannot fully simplify regular expression due to non-Latin characters", UnicodeWarning)
-            return False
+        ans = MatchBoth(regex_nfa(a), MatchDFA(regex_nfa(b), negate=True)).min_length() is None
+        logger.debug("%s =%s=> %s", a, "=" if ans else "/", b)
+        return ans
     return False
 
 
-def regex(pattern: str) -> Regex:
-    """Generate a Regex object directly from basic regular expression syntax. Useful for testing."""
-
-    from pyparsing import Forward, Literal, OneOrMore, ParserElement, Word, infixNotation, nums, opAssoc
+@lru_cache(maxsize=None)
+def regex_grammar(extra_printables: str) -> "ParserElement":
+    """The basic regular expression grammar, built on first use (and cached for each value of EXTRA_PRINTABLES)."""
+    from pyparsing import Forward, Literal, OneOrMore, ParserElement, Word, infixNotation, nums, opAssoc, srange
+    from pyparsing import pyparsing_unicode as ppu
 
     ParserElement.setDefaultWhitespaceChars("")
     ParserElement.enablePackrat()
 
     _0_to_99 = Word(nums, min=1, max=2).setParseAction(lambda t: int("".join(t[0])))
-    printables = ppu.Latin1.printables + " " + EXTRA_PRINTABLES
+    printables = ppu.Latin1.printables + " " + extra_printables
     literal_exclude = r"()+*.?{}^|$\[]"
     set_exclude = r"\]"
 
@@ -1557,8 +3513,151 @@ def regex(pattern: str) -> Regex:
     )
     items = OneOrMore(item).setParseAction(lambda t: RegexConcat(t))
     expr <<= infixNotation(items, [("|", 2, opAssoc.LEFT, lambda t: RegexUnion(t[0][::2]))])
+    return expr
+
+
+def regex(pattern: str) -> Regex:
+    """Generate a Regex object directly from basic regular expression syntax. Useful for testing."""
+    return regex_grammar(EXTRA_PRINTABLES).parseString(pattern, parseAll=True)[0]
+
+
+def pattern_cache_key(pattern: str, *paths: Optional[str]) -> str:
+    """Cache key for a compiled pattern, based on the pattern text and the contents of any files it uses."""
+    hash = hashlib.sha256(f"{NFA_FORMAT_VERSION}:{EXTRA_PRINTABLES}:{pattern}".encode("utf-8"))
+    for path in paths:
+        hash.update(b"\0" + (Path(path).read_bytes() if path else b""))
+    return hash.hexdigest()
 
-    return expr.parseString(pattern, parseAll=True)[0]
+
+def load_cached_nfa(cache_file: Path, compile: Callable[[], NFA], description: str = "pattern") -> NFA:
+    """Load compiled NFA from the cache file, or compile it and save it there."""
+    if cache_file.exists():
+        try:
+            nfa = NFA.from_bytes(cache_file.read_bytes())
+            logger.info(f"Loaded compiled {description} from '{cache_file}'")
+            return nfa
+        except (ValueError, IndexError) as e:
+            logger.warning(f"Ignoring invalid cache file '{cache_file}': {e}")
+    nfa = compile()
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        temp_file.write_bytes(nfa.to_bytes())
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        logger.warning(f"Failed to cache compiled {description} in '{cache_file}': {e}")
+    return nfa
+
+
+def load_cached_pattern(pattern: str, cache_file: Path, compile: Callable[[], Pattern]) -> Pattern:
+    """Load compiled pattern from the cache file, or compile it and save it there."""
+    return Pattern(pattern, load_cached_nfa(cache_file, lambda: compile().nfa))
+
+
+def match_output(pattern: Union[Pattern, MultiPattern], word: str) -> Optional[str]:
+    """Output line for a matching word (with any captures), or None if it doesn't match.
+    For multiple patterns, there is a separate tab-separated output line for each matching pattern."""
+
+    def output(match: CaptureOutput) -> str:
+        return f"{word} ({', '.join(f'{k}={v}' for k,v in sorted(match.items()))})" if match else word
+
+    if isinstance(pattern, MultiPattern):
+        matches = pattern.match(word)
+        return "\n".join(f"{pattern.patterns[n].pattern}\t{output(match)}" for n, match in matches.items()) or None
+    match = pattern.match(word)
+    return None if match is None else output(match)
+
+
+def file_chunks(path: str, chunk_size: int = PARALLEL_CHUNK_SIZE) -> List[Tuple[str, int, int]]:
+    """Split a file into line-aligned byte ranges of roughly the given size."""
+    chunks: List[Tuple[str, int, int]] = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return chunks
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            start = 0
+            while start < size:
+                end = size if start + chunk_size >= size else m.find(b"\n", start + chunk_size - 1) + 1 or size
+                chunks.append((path, start, end))
+                start = end
+    return chunks
+
+
+MATCH_WORKER_PATTERN: Optional[Union[Pattern, MultiPattern]] = None
+
+
+def init_match_worker(nfa: Union[bytes, Sequence[Tuple[str, bytes]]]) -> None:
+    """Initialise a file matching worker process with a serialised NFA (or a sequence of named NFAs)."""
+    global MATCH_WORKER_PATTERN
+    if isinstance(nfa, bytes):
+        MATCH_WORKER_PATTERN = Pattern("", NFA.from_bytes(nfa))
+    else:
+        MATCH_WORKER_PATTERN = MultiPattern(Pattern(name, NFA.from_bytes(data)) for name, data in nfa)
+
+
+def match_chunk(chunk: Tuple[str, int, int]) -> List[str]:
+    """Match the lines in a file chunk, using the same newline handling as reading the file in text mode."""
+    path, start, end = chunk
+    assert MATCH_WORKER_PATTERN is not None
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        text = m[start:end].decode("utf-8")
+    outputs = (match_output(MATCH_WORKER_PATTERN, w.rstrip("\n")) for w in io.StringIO(text, newline=None))
+    return [output for output in outputs if output is not None]
+
+
+def search_range(pattern: Pattern, path: str, start: int = 0, end: Optional[int] = None, overlapping: bool = False) -> Iterator[str]:
+    """Output lines (giving the byte offset and the substring, like grep -bo) for the matches within the lines of a
+    line-aligned byte range of a file. The file is memory-mapped, so only one line is decoded at a time."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            end = len(m) if end is None else end
+            while start < end:
+                line_end = m.find(b"\n", start, end) + 1 or end
+                line = m[start:line_end].decode("utf-8").rstrip("\r\n")
+                for s, e in pattern.search(line, overlapping):
+                    yield f"{start + len(line[:s].encode('utf-8'))}:{line[s:e]}"
+                start = line_end
+
+
+def search_chunk(chunk: Tuple[str, int, int], overlapping: bool = False) -> List[str]:
+    """Search the lines in a file chunk."""
+    assert isinstance(MATCH_WORKER_PATTERN, Pattern)
+    return list(search_range(MATCH_WORKER_PATTERN, *chunk, overlapping=overlapping))
+
+
+def match_files(pattern: Union[Pattern, MultiPattern], files: Sequence[str], jobs: int = 1, search: bool = False, overlapping: bool = False) -> None:
+    """Print the lines in the given files that match the pattern (using multiple processes if requested).
+    If search is set, then print the matching substrings within the lines instead."""
+    if jobs > 1 and files:
+        if isinstance(pattern, MultiPattern):
+            nfa: Union[bytes, List[Tuple[str, bytes]]] = [(p.pattern, p.nfa.to_bytes()) for p in pattern.patterns]
+        else:
+            nfa = pattern.nfa.to_bytes()
+        worker = partial(search_chunk, overlapping=overlapping) if search else match_chunk
+        with multiprocessing.Pool(jobs, initializer=init_match_worker, initargs=(nfa,)) as pool:
+            for file in files:
+                logger.info(f"{'Searching' if search else 'Matching'} pattern against '{file}' using {jobs} processes")
+                for outputs in pool.imap(worker, file_chunks(file)):
+                    if outputs:
+                        print("\n".join(outputs), flush=True)
+        return
+
+    for file in files:
+        if search:
+            assert isinstance(pattern, Pattern)
+            logger.info(f"Searching pattern against '{file}'")
+            for output in search_range(pattern, file, overlapping=overlapping):
+                print(output, flush=True)
+            continue
+        logger.info(f"Matching pattern against '{file}'")
+        with open(file, "r", encoding="utf-8") as f:
+            for w in f:
+                output = match_output(pattern, w.rstrip("\n"))
+                if output is not None:
+                    print(output, flush=True)
 
 
 def main() -> None:
@@ -1637,53 +3736,145 @@ REFERENCES
     )
     parser.add_argument("pattern", type=str, help="pattern to compile")
     parser.add_argument("files", type=str, nargs="*", help="filenames to search")
-    parser.add_argument("-d", dest="dict", metavar="PATH", type=str, help="dictionary file to use for \\w", default=None)
+    parser.add_argument("-d", dest="dict", metavar="PATH", type=str, help="dictionary file to use for \\w (either a word list or saved binary)", default=None)
+    parser.add_argument("--save-dict", metavar="PATH", type=str, help="save the compiled dictionary in binary format (for use with -d)")
     parser.add_argument("-f", dest="fsm", metavar="PATH", type=str, help="FSM file to use for \\f", default=None)
     parser.add_argument("-D", dest="DFA", action="store_true", help="convert NFA to DFA", default=None)
     parser.add_argument("-M", dest="min", action="store_true", help="convert NFA to minimal DFA ", default=None)
     parser.add_argument("-i", dest="case_insensitive", action="store_true", help="case insensitive match")
     parser.add_argument("-v", dest="invert", action="store_true", help="invert match")
-    parser.add_argument("-s", dest="svg", metavar="NAME", default=None, help="save FSM image and description")
+    parser.add_argument("-s", dest="svg", metavar="NAME", default=None, help="save FSM image and description (as .fsm text and .fsmb binary)")
     parser.add_argument("-c", dest="console", action="store_true", help="save FSM image for console")
     parser.add_argument("-C", dest="compact", action="store_true", help="compact start/end nodes in FSM image")
     parser.add_argument("-x", dest="example", action="store_true", help="generate an example matching string")
     parser.add_argument("-r", dest="regex", action="store_true", help="generate a standard equivalent regex")
     parser.add_argument("-b", dest="bounds", action="store_true", help="generate lexicographic match bounds")
+    parser.add_argument(
+        "-P",
+        dest="patterns",
+        metavar="PATH",
+        help="match all the patterns in a file (one per line) in a single pass,\ntreating the pattern argument as a filename to search",
+    )
+    parser.add_argument("-j", dest="jobs", metavar="N", type=int, default=1, help="match files using N processes")
+    parser.add_argument(
+        "--search", action="store_true", help="output matching substrings within lines (with their byte offsets)\nrather than whole matching lines"
+    )
+    parser.add_argument(
+        "--overlapping", action="store_true", help="output the longest match ending at every offset with --search\n(rather than non-overlapping matches)"
+    )
+    parser.add_argument(
+        "--cache-dir", metavar="PATH", default=DEFAULT_CACHE_DIR, help=f"directory for caching compiled patterns (default: {DEFAULT_CACHE_DIR})"
+    )
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write compiled pattern cache")
+    parser.add_argument("--profile", action="store_true", help="output NFA construction statistics for the pattern (bypassing the cache)")
     group = parser.add_mutually_exclusive_group()
-    group.add_argument("-X", dest="examples_only", metavar="N", type=int, help="output N example matches and quit")
+    group.add_argument("-X", dest="examples_only", metavar="N", type=int, help="output N uniformly random example matches and quit")
+    group.add_argument("-E", dest="enumerate_only", metavar="N", type=int, help="output the first N matches (by length, then alphabetically) and quit")
+    group.add_argument("-K", dest="count_only", action="store_true", help="output the number of matches of each length and quit")
     group.add_argument("-R", dest="regex_only", action="store_true", help="output a standard equivalent regex and quit")
+    parser.add_argument("-l", dest="lengths", metavar="M-N", type=str, help="restrict -X, -E and -K to matches of length M to N (or M-, or N)")
+    parser.add_argument("--offset", metavar="N", type=int, default=0, help="skip the first N matches output by -E")
 
     args = parser.parse_args()
-    global DICTIONARY_FSM, EXPLICIT_FSM, SLOW_SIMPLIFICATION
+    global SLOW_SIMPLIFICATION
 
-    if args.examples_only is not None or args.regex_only:
+    if args.search and args.patterns:
+        parser.error("--search cannot be used with -P")
+
+    if args.examples_only is not None or args.enumerate_only is not None or args.count_only or args.regex_only:
         logger.setLevel(logging.ERROR)
         warnings.simplefilter("ignore")
         SLOW_SIMPLIFICATION = False
 
-    if args.dict:
-        logger.info(f"Compiling dictionary from '{args.dict}'")
-        DICTIONARY_FSM = MatchDictionary(Path(args.dict))
-    if args.fsm:
-        logger.info(f"Compiling FSM from '{args.fsm}'")
-        EXPLICIT_FSM = ExplicitFSM(Path(args.fsm))
-
-    pattern = args.pattern
-    if args.case_insensitive:
-        pattern = f"(?i:{pattern})"
-    if args.invert:
-        pattern = f"!({pattern})"
-    if args.min:
-        pattern = f"(?M:{pattern})"
-    elif args.DFA:
-        pattern = f"(?D:{pattern})"
-
-    logger.info(f"Compiling pattern '{pattern}'")
-    pattern = Pattern(pattern)
+    def load_dictionary() -> NFA:
+        global DICTIONARY_FSM
+        if DICTIONARY_FSM is None:
+
+            def compile_dictionary() -> NFA:
+                logger.info(f"Compiling dictionary from '{args.dict}'")
+                return MatchDictionary(Path(args.dict))
+
+            if args.no_cache:
+                DICTIONARY_FSM = compile_dictionary()
+            else:
+                cache_file = Path(args.cache_dir).expanduser() / f"{pattern_cache_key(DICTIONARY_CACHE_KEY, args.dict)}.nfa"
+                DICTIONARY_FSM = load_cached_nfa(cache_file, compile_dictionary, "dictionary")
+        return DICTIONARY_FSM
+
+    if args.save_dict:
+        if not args.dict:
+            parser.error("--save-dict requires a dictionary file (-d)")
+        dictionary = load_dictionary()
+        logger.info(f"Saving compiled dictionary to '{args.save_dict}'")
+        Path(args.save_dict).write_bytes(dictionary.to_bytes())
+
+    def compile(pattern: str) -> Pattern:
+        global EXPLICIT_FSM
+        if args.dict:
+            load_dictionary()
+        if args.fsm and EXPLICIT_FSM is None:
+            logger.info(f"Compiling FSM from '{args.fsm}'")
+            EXPLICIT_FSM = ExplicitFSM(Path(args.fsm))
+        logger.info(f"Compiling pattern '{pattern}'")
+        if not args.profile:
+            return Pattern(pattern)
+        with Profiler() as profiler:
+            compiled = Pattern(pattern)
+        print(profiler.report(), file=sys.stderr)
+        return compiled
+
+    def load(name: str) -> Pattern:
+        pattern = name
+        if args.case_insensitive:
+            pattern = f"(?i:{pattern})"
+        if args.invert:
+            pattern = f"!({pattern})"
+        if args.min:
+            pattern = f"(?M:{pattern})"
+        elif args.DFA:
+            pattern = f"(?D:{pattern})"
+        if args.no_cache or args.profile:
+            compiled = compile(pattern)
+        else:
+            cache_file = Path(args.cache_dir).expanduser() / f"{pattern_cache_key(pattern, args.dict, args.fsm)}.nfa"
+            compiled = load_cached_pattern(pattern, cache_file, lambda: compile(pattern))
+        return Pattern(name, compiled.nfa) if args.patterns else compiled
+
+    if args.patterns:
+        with open(args.patterns, "r", encoding="utf-8") as f:
+            names = [line.rstrip("\n") for line in f if line.rstrip("\n")]
+        multipattern = MultiPattern(load(name) for name in names)
+        match_files(multipattern, [args.pattern, *args.files], args.jobs)
+        return
+
+    pattern = load(args.pattern)
+
+    min_length, max_length = 0, None
+    if args.lengths:
+        lengths = re.fullmatch(r"(\d+)(?:(-)(\d*))?", args.lengths)
+        if lengths is None:
+            parser.error(f"invalid length range: {args.lengths!r}")
+        min_length = int(lengths.group(1))
+        max_length = int(lengths.group(3)) if lengths.group(3) else None if lengths.group(2) else min_length
 
     if args.examples_only is not None:
         for _ in range(args.examples_only):
-            print(pattern.example())
+            print(pattern.sample(min_length, max_length))
+        return
+
+    if args.enumerate_only is not None:
+        for match in islice(pattern.matches(min_length, max_length, args.offset), args.enumerate_only):
+            print(match)
+        return
+
+    if args.count_only:
+        try:
+            total = pattern.count(min_length, max_length)
+        except ValueError as e:
+            parser.error(str(e))
+        for n in pattern.lengths(min_length, max_length):
+            print(f"{n}: {pattern.counter.count(n)}")
+        print(f"total: {total}")
         return
 
     if args.regex_only:
@@ -1711,29 +3902,9 @@ REFERENCES
         regex = pattern.nfa.regex()
         regex_repr = "$." if regex == RegexUnion() else "^$" if regex == RegexConcat() else f"^{regex}$"
         logger.info(f"Equivalent regex: {regex_repr}")
-        min_length = regex.min_length()
-        max_length = regex.max_length()
-        if min_length == -math.inf:
-            lengths = None
-        elif min_length == max_length:
-            lengths = min_length
-        elif max_length == math.inf:
-            lengths = f"{min_length}+"
-        else:
-            lengths = f"{min_length}-{max_length}"
-        logger.info(f"Match lengths: {lengths}")
+        logger.info(f"Match lengths: {pattern.nfa.length_spectrum() or None}")
 
-    for file in args.files:
-        logger.info(f"Matching pattern against '{file}'")
-        with open(file, "r", encoding="utf-8") as f:
-            for w in f:
-                word = w.rstrip("\n")
-                match = pattern.match(word)
-                if match is not None:
-                    if match:
-                        print(f"{word} ({', '.join(f'{k}={v}' for k,v in sorted(match.items()))})", flush=True)
-                    else:
-                        print(word, flush=True)
+    match_files(pattern, args.files, args.jobs, args.search, args.overlapping)
 
 
 if __name__ == "__main__":
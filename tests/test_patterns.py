@@ -52,3 +52,492 @@ def test_regex_first_character(reg, first_char, last_char):
     """Check that a regex has the expected first and last characters."""
     assert regex(reg).first_character() == regex(first_char)
     assert regex(reg).first_character(from_end=True) == regex(last_char)
+
+
+def test_regex_interning():
+    """Check that equal regexes are the same object."""
+    assert regex("a(b|c)*d") is regex("a(c|b)*d") is RegexConcat((RegexChars("a"), RegexStar(RegexChars("bc")), RegexChars("d")))
+    assert regex("[^ab]") is RegexNegatedChars("ba")
+
+
+@pytest.mark.parametrize(
+    "reg_a,reg_b,implies",
+    [
+        ["(ab)*a", "a(ba)*", True],
+        ["a(ba)*", "(ab)*a", True],
+        ["(aab)*a", "a(ba)*", False],
+        ["(😀b)*😀", "😀(b😀)*", True],
+    ],
+)
+def test_regex_implies(reg_a, reg_b, implies, monkeypatch):
+    """Check implications that need the slow automaton-based check."""
+    monkeypatch.setattr("pudzu.sandbox.patterns.EXTRA_PRINTABLES", "😀")
+    assert regex_implies(regex(reg_a), regex(reg_b)) == implies
+
+
+@pytest.mark.parametrize(
+    "pattern,matches,nonmatches",
+    [
+        ["the", ["the"], ["", "th", "thee"]],
+        ["a|the", ["a", "the"], ["at", ""]],
+        ["[ae].[^y]", ["abc", "e z"], ["aby", "bbc"]],
+        ["¬(.*no.*)", ["", "yes", "on"], ["no", "snot"]],
+        ["o+<l+", ["loooll", "ol", "lo"], ["lol0", "oo"]],
+        ["the^A+", ["tAAhAe", "theA"], ["the", "tAAhAeA0"]],
+        ["(the|a)-.", ["th", ""], ["the", "a"]],
+        ["(?R<=2:hello)", ["elloh", "lohel", "ohell"], ["hello", "lleho"]],
+    ],
+)
+def test_lazy_dfa_match(pattern, matches, nonmatches):
+    """Check that lazy DFA matching agrees with the capture-tracking matcher."""
+    nfa = Pattern(pattern).nfa
+    lazy = LazyDFA(nfa.compiled(), max_states=3)
+    for string in matches:
+        assert nfa.match(string) == {}
+        assert nfa.match_captures(string) is not None
+        assert nfa.compiled().match(string)
+        assert lazy.match(string)
+    for string in nonmatches:
+        assert nfa.match(string) is None
+        assert nfa.match_captures(string) is None
+        assert not nfa.compiled().match(string)
+        assert not lazy.match(string)
+
+
+@pytest.mark.parametrize(
+    "pattern,string,captures",
+    [
+        ["(?<x>a+)b(?<y>c*)", "aabcc", {"x": "aa", "y": "cc"}],
+        ["(?<x>a+)b(?<y>c*)", "aab", {"x": "aa"}],
+        ["(?<x>a+)b(?<y>c*)", "aabd", None],
+        ["(?<start>.*)(?<end>.)", "hello", {"start": "hell", "end": "o"}],
+        ["(?<tel>[0-9]+)( (?<tel>[0-9]+))*", "01 23 45", {"tel": "012345"}],
+    ],
+)
+def test_match_captures(pattern, string, captures):
+    """Check the captures reconstructed from the accepting path."""
+    nfa = Pattern(pattern).nfa
+    assert nfa.match(string) == nfa.match_captures(string) == captures
+
+
+def splits(string):
+    return [(string[:i], string[i:j], string[j:]) for i in range(len(string) + 1) for j in range(i, len(string) + 1)]
+
+
+@pytest.mark.parametrize(
+    "pattern,language",
+    [
+        ["A->B", lambda A, B: {x + z for w in A for x, y, z in splits(w) if y in B}],
+        ["A->>B", lambda A, B: {x + z for w in A for x, y, z in splits(w) if y in B and x and z}],
+        ["A-<B", lambda A, B: {y for w in A for x, y, z in splits(w) if x + z in B}],
+        ["A-<<B", lambda A, B: {y for w in A for x, y, z in splits(w) if x + z in B and x and z}],
+        ["(?R1:A)", lambda A, B: {w[-1:] + w[:-1] for w in A if len(w) > 1}],
+        ["(?R-1:A)", lambda A, B: {w[1:] + w[:1] for w in A if len(w) > 1}],
+    ],
+)
+def test_partial_intersections(pattern, language):
+    """Check the operators built from partial intersections against their definitions, for finite languages."""
+    A, B = ["abc", "abcb", "ba", "cab"], ["b", "ca", "abc"]
+    pattern = Pattern(pattern.replace("A", f"({'|'.join(A)})").replace("B", f"({'|'.join(B)})"))
+    strings = {"".join(p) for n in range(6) for p in product("abc", repeat=n)}
+    assert {s for s in strings if pattern.match(s) is not None} == language(A, B)
+
+
+@pytest.mark.parametrize(
+    "pattern,min_length,lower_bound,upper_bound",
+    [
+        ["the", 3, "the", "thf"],
+        ["a|the", 1, "a", "thf"],
+        ["o+h?", 1, "o", "oop"],
+        ["(?&v=[aeiou])(?&v).(?&v)", 3, "a a", "u~v"],
+        ["a&b", None, "", ""],
+    ],
+)
+def test_compiled_analysis(pattern, min_length, lower_bound, upper_bound):
+    """Check the min length and lexicographic bounds calculated from the compiled NFA."""
+    nfa = Pattern(pattern).nfa
+    assert nfa.min_length() == min_length
+    assert nfa.bound(True, 3) == lower_bound
+    assert nfa.bound(False, 3) == upper_bound
+    example = nfa.example()
+    assert example is None if min_length is None else nfa.match(example) is not None
+
+
+@pytest.mark.parametrize(
+    "pattern,states,matches,nonmatches",
+    [
+        ["(a|b)*c", 3, ["c", "abbac"], ["", "ab", "cc"]],
+        ["¬(.*no.*)", 4, ["", "on", "nyo"], ["no", "snot"]],
+        [".*a.{3}", 18, ["abcd", "xxaaaa"], ["aaa", "abcde"]],
+        ["(b+)&(...)", 4, ["bbb"], ["bb", "bbbb"]],
+        ["a&b", 2, [], ["", "a", "b"]],
+    ],
+)
+def test_minimal_dfa(pattern, states, matches, nonmatches):
+    """Check that minimal DFAs have the expected number of states and still match correctly."""
+    nfa = Pattern(f"(?M:{pattern})").nfa
+    assert len(nfa.states) == states
+    assert all(nfa.match(string) is not None for string in matches)
+    assert all(nfa.match(string) is None for string in nonmatches)
+
+
+@pytest.mark.parametrize(
+    "pattern,strings",
+    [
+        ["(?<x>a+)b(?<y>c?)", ["aabc", "ab", "abcc", ""]],
+        ["[^a-c]+&.*d.*", ["xyd", "dad", "d", "de"]],
+        ["¬(ab*)", ["", "a", "abb", "ba"]],
+    ],
+)
+def test_binary_fsm(pattern, strings, tmp_path):
+    """Check that NFAs survive a round trip through the binary format and the compiled pattern cache."""
+    nfa = Pattern(pattern).nfa
+    loaded = NFA.from_bytes(nfa.to_bytes())
+    assert len(loaded.states) == len(nfa.states)
+    assert all(loaded.match(string) == nfa.match(string) for string in strings)
+    cache_file = tmp_path / "pattern.nfa"
+    cached = load_cached_pattern(pattern, cache_file, lambda: Pattern(pattern))
+    assert cache_file.exists()
+    cached = load_cached_pattern(pattern, cache_file, lambda: pytest.fail("pattern recompiled"))
+    assert all(cached.match(string) == nfa.match(string) for string in strings)
+    with pytest.raises(ValueError):
+        NFA.from_bytes(nfa.to_bytes()[:-5])
+
+
+@pytest.mark.parametrize(
+    "pattern,strings",
+    [
+        ["(?<x>a+)b(?<y>c*)|[^ab ]{2}", ["aabcc", "ab", "cd", "a b", "bc", ""]],
+        ["(?<w>.*) (?<w>.)", ["ab c", "a b c", "abc"]],
+    ],
+)
+def test_saved_fsm(pattern, strings, tmp_path):
+    """Check that the .fsm and .fsmb files saved for -s can be loaded back in with \\f (including captures)."""
+    nfa = Pattern(pattern).nfa
+    nfa.save(str(tmp_path / "saved"))
+    for extension in ("fsm", "fsmb"):
+        loaded = ExplicitFSM(tmp_path / f"saved.{extension}")
+        assert all(loaded.match(string) == nfa.match(string) for string in strings)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 20])
+def test_parallel_matching(chunk_size, tmp_path):
+    """Check that matching file chunks gives the same output as matching the file line by line."""
+    path = tmp_path / "words.txt"
+    path.write_bytes("café\nabc\r\nçà va\rhello\n\nthe end".encode("utf-8"))
+    pattern = Pattern("(?<x>[a-zç]+)(?<y>[^a-zç].*)?")
+    with open(path, "r", encoding="utf-8") as f:
+        expected = [output for w in f for output in [match_output(pattern, w.rstrip("\n"))] if output is not None]
+    init_match_worker(pattern.nfa.to_bytes())
+    chunks = file_chunks(str(path), chunk_size)
+    assert chunks[0][1] == 0 and chunks[-1][2] == path.stat().st_size
+    assert [output for chunk in chunks for output in match_chunk(chunk)] == expected
+
+
+@pytest.mark.parametrize(
+    "pattern,lengths,prefix,suffix,literals,matches,nonmatches",
+    [
+        ["abc", (3, 3), "abc", "abc", ["abc"], ["abc"], ["ab", "abd", "xbc"]],
+        [".*the.*", (3, None), "", "", ["the"], ["the", "bathe", "there"], ["th", "hte", "tehe"]],
+        [".*e.*&.*s", (2, None), "", "s", ["e", "s"], ["es", "eats"], ["as", "ease", "seat"]],
+        ["x.*(abc|abd)", (4, None), "x", "", ["ab", "x"], ["xabc", "xyzabd"], ["xab", "abc", "xabe"]],
+        ["(ab)^(cd)", (4, 4), "", "", ["a", "b", "c", "d"], ["abcd", "acbd", "cadb"], ["abdc", "abc", "abcde"]],
+        ["[^a].*b", (2, None), "", "b", ["b"], ["bb", "xayb"], ["ab", "b", "bc"]],
+        ["a&b", (None, None), "", "", [], [], ["", "a", "b"]],
+    ],
+)
+def test_prefilter(pattern, lengths, prefix, suffix, literals, matches, nonmatches):
+    """Check the prefilters derived from an NFA, and that they never reject a match."""
+    pattern = Pattern(pattern)
+    prefilter = pattern.prefilter
+    assert (prefilter.min_length, prefilter.max_length) == lengths
+    assert (prefilter.prefix, prefilter.suffix) == (prefix, suffix)
+    assert sorted(prefilter.literals) == literals
+    assert all(prefilter(string) and pattern.match(string) is not None for string in matches)
+    assert all(pattern.match(string) is None for string in nonmatches)
+
+
+@pytest.mark.parametrize("pattern", ["abc", "a*", "(ab|c)d?", "a&b", "a(b|(c(de)?)){0,2}f", "(a?)*", "((a?)*)&.{2}", "(abc)#(de)", "(?S:hello)[1:3]"])
+def test_max_length(pattern):
+    """Check that the max length calculated from the compiled NFA matches the one from the equivalent regex."""
+    nfa = Pattern(pattern).nfa
+    max_length = nfa.regex().max_length()
+    assert nfa.max_length() == (max_length if math.isfinite(max_length) else None)
+
+
+@pytest.mark.parametrize(
+    "pattern,spectrum",
+    [
+        ["abc", "3"],
+        ["a{2,4}|a{7}", "2-4, 7"],
+        ["(ab|abc)*", "0, 2+"],
+        ["x(..)*", "2n+1"],
+        ["(aa)*|(aaa)*", "6n, 6n+2, 6n+3, 6n+4"],
+        ["(a{3})+a{1,2}", "3n+4, 3n+5"],
+        ["a&b", ""],
+    ],
+)
+def test_length_spectrum(pattern, spectrum):
+    """Check that the length spectrum is calculated and normalised correctly."""
+    nfa = Pattern(pattern).nfa
+    lengths = nfa.length_spectrum()
+    assert str(lengths) == spectrum
+    assert (lengths.min_length, lengths.max_length) == (nfa.min_length(), nfa.max_length())
+    assert list(islice(lengths, 5)) == [n for n in range(30) if n in lengths][:5]
+    assert all((n in lengths) == (Pattern(f"({pattern})&.{{{n}}}").nfa.min_length() is not None) for n in range(15))
+
+
+@pytest.mark.parametrize(
+    "pattern,alphabet",
+    [
+        ["(the|a)+", "tha"],
+        ["o+<l+", "ol"],
+        ["¬(.*no.*)", "nox"],
+        ["(ab|ba)*&.*a.*", "ab"],
+        ["U+#w+", "Uw"],
+        ["lo+l->>.", "lo"],
+        ["Madrid-^..", "Madri"],
+        ["(?M:b*)", "ab"],
+        ["(?M:a(ba)*)", "ab"],
+        ["(?M:(ab)*)b", "ab"],
+        ["(?M:¬(.*no.*))", "nox"],
+        [NFA("1", "2", {("1", "a"): {"1"}, ("1", "b"): {"2"}, ("2", "c"): {"1", "2"}}), "abc"],
+    ],
+)
+def test_regex_equivalence(pattern, alphabet):
+    """Check that the regex generated from an NFA matches the same strings as the NFA."""
+    pattern = Pattern(pattern) if isinstance(pattern, str) else Pattern("", pattern)
+    compiled = re.compile(str(pattern.nfa.regex()))
+    for n in range(7):
+        for string in map("".join, product(alphabet, repeat=n)):
+            assert (pattern.match(string) is not None) == bool(compiled.fullmatch(string))
+
+
+@pytest.mark.parametrize(
+    "pattern,text,matches,overlapping",
+    [
+        ["the|there", "there the other", ["there", "the", "the"], ["the", "there", "the", "the"]],
+        ["a+", "baaab aa", ["aaa", "aa"], ["a", "aa", "aaa", "a", "aa"]],
+        [".*e", "hello there", ["hello there"], ["he", "hello the", "hello there"]],
+        ["[a-z]+&.*e.*", "one two three", ["one", "three"], ["one", "thre", "three"]],
+        ["x*", "xyz", ["x"], ["x"]],
+        ["q", "xyz", [], []],
+    ],
+)
+def test_search(pattern, text, matches, overlapping):
+    """Check that searching finds the expected substrings."""
+    pattern = Pattern(pattern)
+    assert [text[s:e] for s, e in pattern.search(text)] == matches
+    assert [text[s:e] for s, e in pattern.search(text, overlapping=True)] == overlapping
+
+
+@pytest.mark.parametrize("chunk_size", [1, 1 << 20])
+def test_search_file(chunk_size, tmp_path):
+    """Check that searching a file outputs byte offsets, and that searching file chunks gives the same output."""
+    path = tmp_path / "text.txt"
+    path.write_bytes("there the\n\ncafé the\r\nthe end".encode("utf-8"))
+    pattern = Pattern("the|there")
+    assert list(search_range(pattern, str(path))) == ["0:there", "6:the", "17:the", "22:the"]
+    init_match_worker(pattern.nfa.to_bytes())
+    assert [output for chunk in file_chunks(str(path), chunk_size) for output in search_chunk(chunk)] == list(search_range(pattern, str(path)))
+
+
+@pytest.mark.parametrize(
+    "string,matches",
+    [
+        ["cat", {1: {"x": "c"}, 2: {}, 4: {}}],
+        ["cet", {0: {}, 2: {}, 4: {}}],
+        ["feet", {0: {}}],
+        ["ca", {1: {"x": "c"}}],
+        ["", {}],
+    ],
+)
+def test_multipattern(string, matches):
+    """Check that multiple patterns can be matched in a single pass."""
+    multipattern = MultiPattern([".*e.*", "(?<x>.)a.*", "c.t", "a&b", "..."])
+    assert multipattern.match(string) == matches
+    assert all((multipattern.patterns[n].match(string) is not None) == (n in matches) for n in range(len(multipattern)))
+
+
+@pytest.mark.parametrize(
+    "pattern,min_length,max_length,count,first_matches",
+    [
+        ["[ab]{2,3}c?", 0, None, 24, ["aa", "ab", "ba", "bb", "aaa"]],
+        ["(?i:hi)", 0, None, 4, ["HI", "Hi", "hI", "hi"]],
+        ["[abc]{3}&.*a.*", 0, None, 19, ["aaa", "aab", "aac", "aba", "abb"]],
+        ["a*", 2, 4, 3, ["aa", "aaa", "aaaa"]],
+        [".{2}", 0, None, len(EXAMPLE_ALPHABET) ** 2, [" " * 2, " '", " 0", " 1", " 2"]],
+        ["a&b", 0, None, 0, []],
+    ],
+)
+def test_match_counting(pattern, min_length, max_length, count, first_matches):
+    """Check that matches can be counted, enumerated and sampled."""
+    pattern = Pattern(pattern)
+    assert pattern.count(min_length, max_length) == count
+    assert list(islice(pattern.matches(min_length, max_length), 5)) == first_matches
+    assert list(islice(pattern.matches(min_length, max_length, offset=2), 3)) == first_matches[2:]
+    sample = pattern.sample(min_length, max_length)
+    assert sample is None if count == 0 else pattern.match(sample) is not None and min_length <= len(sample)
+
+
+def test_infinite_match_counting():
+    """Check that counting an infinite language raises."""
+    pattern = Pattern("¬(.*a.*)")
+    with pytest.raises(ValueError):
+        pattern.count()
+    assert pattern.count(max_length=2) == 1 + (len(EXAMPLE_ALPHABET) - 1) + (len(EXAMPLE_ALPHABET) - 1) ** 2
+    assert len(pattern.sample(3)) <= 3 + EXAMPLE_LENGTH_RANGE
+
+
+@pytest.mark.parametrize(
+    "words,states,nonmatches",
+    [
+        [["cat", "cats", "bat", "bats"], 6, ["", "ca", "catss", "bast"]],
+        [["tap", "taps", "top", "tops", "tip", "tips"], 6, ["tup", "tapss", "ta"]],
+        [["b", "ab", "", "b"], 4, ["", "a", "bb"]],
+        [["abc", "xbc", "xyz"], 7, ["xbz", "ayz"]],
+    ],
+)
+def test_dictionary(words, states, nonmatches, tmp_path):
+    """Check that word lists generate minimal automata that can be saved and reloaded."""
+    nfa = MatchWords(words)
+    assert len(nfa.states) == states
+    assert all(nfa.match(word) is not None for word in words if word)
+    assert all(nfa.match(word) is None for word in nonmatches)
+    (tmp_path / "words.txt").write_text("\n".join(reversed(words)), encoding="utf-8")
+    (tmp_path / "words.nfa").write_bytes(nfa.to_bytes())
+    for path in ["words.txt", "words.nfa"]:
+        dictionary = MatchDictionary(tmp_path / path)
+        assert all(dictionary.match(word) is not None for word in words if word)
+        assert all(dictionary.match(word) is None for word in nonmatches)
+
+
+def test_profiler():
+    """Check that NFA construction statistics are recorded as a tree."""
+    with Profiler() as profiler:
+        pattern = Pattern("(a|c+)&.*c")
+    assert PROFILER is None
+    root = profiler.roots[-1]
+    assert root.name == "MatchBoth"
+    assert (root.states, root.transitions) == (len(pattern.nfa.states), len(pattern.nfa.transitions))
+    assert [c.name for c in root.children] == ["MatchEither", "MatchAfter"]
+    assert root.input_states == sum(c.states for c in root.children)
+    assert root.trimmed_states > 0
+    assert profiler.report().count("MatchIn(characters='c')") == 1  # shared subexpressions are only built once
+
+
+@pytest.mark.parametrize(
+    "pattern,optimised",
+    [
+        ["[ab]|c", "MatchIn('abc')"],
+        ["[^ab]|a", "MatchNotIn('b')"],
+        ["[a-c]&[^b]", "MatchIn('ac')"],
+        ["cat|dog", "MatchWords(('cat', 'dog'))"],
+        ["(?&v=[ae])x(?&v)", "MatchAfter(MatchIn('x'), MatchIn('ae'))"],
+        ["(a{2}){3}", "MatchRepeatedN(MatchIn('a'), 6, 6)"],
+        ["(?r:(?r:ab))", "MatchAfter(MatchIn('a'), MatchIn('b'))"],
+        ["a+&b*&c", "MatchBoth(MatchIn('c'), MatchRepeated(MatchIn('a'), True, False), MatchRepeated(MatchIn('b'), True, True))"],
+    ],
+)
+def test_ast_optimisation(pattern, optimised):
+    """Check that pattern ASTs are optimised."""
+    assert repr(Pattern(pattern).ast) == optimised
+
+
+@pytest.mark.parametrize(
+    "pattern,strings",
+    [
+        ["a{2,4}", ["", "a", "aa", "aaa", "aaaa", "aaaaa"]],
+        ["(ab){0,2}c", ["c", "abc", "ababc", "abababc", "ab"]],
+        ["(a|bc){2,}", ["a", "aa", "abc", "bcbca", "bcb"]],
+        ["(?<x>a)(?&y=b)(?&y){2}|cat|dog", ["abb", "cat", "dog", "cow"]],
+        ["(?s:ab)", ["ab", "bc", "za", "ac"]],
+    ],
+)
+def test_ast_equivalence(pattern, strings):
+    """Check that optimised ASTs match the same strings as unoptimised ones."""
+    unoptimised = Pattern(pattern, Pattern.parse(pattern).build())
+    for string in strings:
+        assert Pattern(pattern).match(string) == unoptimised.match(string)
+
+
+@pytest.mark.parametrize(
+    "pattern,strings",
+    [
+        ["(?M:.*a.{3})", ["abcd", "bcde", "xxaxxx", "a", ""]],
+        ["[^a]*b.{2}&.*c", ["bbc", "abc", "xbxc", "cbcc", "bc"]],
+        ["(?i:th.*ing)", ["thing", "THING", "thinG", "thin", "tthing"]],
+        ["¬(.*e.*)", ["", "abc", "e", "bee"]],
+    ],
+)
+def test_bit_parallel_matching(pattern, strings):
+    """Check that bit-parallel simulation matches the same strings as the lazy DFA."""
+    nfa = Pattern(pattern).nfa
+    bit_parallel = BitParallelNFA(nfa.compiled())
+    for string in strings:
+        assert bit_parallel.match(string) == nfa.lazy_dfa().match(string)
+
+
+def test_bit_parallel_switch():
+    """Check that small NFAs switch to bit-parallel matching when their lazy DFA blows up."""
+    pattern = Pattern(".*a.{10}")
+    assert isinstance(pattern.nfa.matcher(), LazyDFA)
+    strings = ["".join(random.choice("ab") for _ in range(20)) for _ in range(200)]
+    matches = [pattern.match(s) is not None for s in strings]
+    assert isinstance(pattern.nfa.matcher(), BitParallelNFA)
+    assert matches == [pattern.match(s) is not None for s in strings] == [s[-11] == "a" for s in strings]
+
+
+@pytest.mark.parametrize(
+    "pattern,classes,table,strings",
+    [
+        ["[a-c]x|[0-9]", ["", "0123456789", "abc", "x"], 256, ["ax", "cx", "bxx", "5", "55", "d", "é"]],
+        ["é+€|.𝄞", ["", "é", "€", "𝄞"], 65536, ["é€", "éé€", "€𝄞", "𝄞𝄞", "😀𝄞", "€", "😀"]],
+        ["[^é]*", ["", "é"], 256, ["", "abc", "aé", "€𝄞"]],
+    ],
+)
+def test_alphabet(pattern, classes, table, strings, monkeypatch):
+    """Check that characters are partitioned into classes, and that class-based matchers agree with the NFA."""
+    monkeypatch.setattr("pudzu.sandbox.patterns.EXTRA_PRINTABLES", "€𝄞")
+    nfa = Pattern(pattern).nfa
+    alphabet = nfa.compiled().alphabet()
+    assert sorted("".join(chars) for chars in alphabet.classes) == classes
+    assert len(alphabet.table) == table
+    assert all(alphabet[c] == id for id, chars in enumerate(alphabet.classes) for c in chars)
+    assert alphabet["😀"] == alphabet["\0"] == 0
+    matches = [nfa.compiled().match(s) for s in strings]
+    assert matches == [nfa.lazy_dfa().match(s) for s in strings] == [BitParallelNFA(nfa.compiled()).match(s) for s in strings]
+    assert matches == BatchMatcher(nfa).match(strings).tolist()
+
+
+@pytest.mark.parametrize(
+    "pattern,strings",
+    [
+        ["(?M:.*a.{3})", ["abcd", "bcde", "xxaxxx", "a", "", "aé€𝄞"]],
+        ["(?<x>a+)b(?<y>c*)", ["ab", "aabcc", "b", "abcd"]],
+        ["[^a]*b.{2}&.*c", ["bbc", "abc", "xbxc", "cbcc", "bc"] * 3],
+        ["¬(.*e.*)", []],
+        ["ab", ["ab", "ab\0", "\0ab"]],
+    ],
+)
+def test_match_many(pattern, strings):
+    """Check that batch matching gives the same results as individual matches."""
+    pattern = Pattern(pattern)
+    assert pattern.match_many(strings).tolist() == [pattern.match(s) is not None for s in strings]
+    assert pattern.match_many(iter(strings)).tolist() == [pattern.match(s) is not None for s in strings]
+    assert pattern.match_many([*strings, None, 1]).tolist()[len(strings) :] == [False, False]
+
+
+def test_mask():
+    """Check that pandas Series can be filtered using pattern masks."""
+    pd = pytest.importorskip("pandas")
+    series = pd.Series(["ab", "aabcc", "b", "abcd"], index=[3, 1, 4, 1], name="word")
+    pattern = Pattern("(?<x>a+)b(?<y>c*)")
+    assert pattern.mask(series).tolist() == [True, True, False, False]
+    assert pattern.mask(series).index.tolist() == [3, 1, 4, 1]
+    captures = pattern.mask(series, captures=True)
+    assert captures["match"].tolist() == [True, True, False, False]
+    assert captures["x"][captures["match"]].tolist() == ["a", "aa"]
+    assert captures["x"].isna().tolist() == [False, False, True, True]
+    assert captures["y"].isna().tolist() == [True, False, True, True]  # empty captures are omitted
+    assert Pattern("n.n").mask(pd.Series(["nan", None, float("nan"), "non"])).tolist() == [True, False, False, True]